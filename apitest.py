@@ -0,0 +1,4109 @@
+#!/usr/bin/env python3
+"""
+API Endpoint Test Script
+
+Tests the backend API for various success and failure scenarios.
+Supports both prod and test environments.
+
+Usage:
+    python api-test.py --env test
+    python api-test.py --env prod
+    python api-test.py --env test --verbose
+
+Environment Variables:
+    API_KEY: API key for authentication (required)
+    PROD_API_URL: Production API endpoint URL (required for --env prod)
+    TEST_API_URL: Test API endpoint URL (required for --env test)
+    API_TEST_CASES: Test case table to load (default: test-cases.json next to this script)
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextvars
+import functools
+import importlib.util
+import inspect
+import io
+import json
+import math
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import types
+import urllib.parse
+from collections import deque
+from contextlib import closing, contextmanager
+from datetime import datetime, timezone
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    requests/urllib3 (with ssl, certifi and charset detection) and asyncio take
+    most of the script's startup time, so --help, argument errors, --history and
+    missing-variable failures finish without loading them; sqlite3, ElementTree
+    and the thread pool are only loaded by the modes that use them. Imports go
+    through importlib, so the first access is thread-safe and later ones are a
+    dict lookup.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}>"
+
+
+asyncio = LazyModule("asyncio")
+futures = LazyModule("concurrent.futures")
+requests = LazyModule("requests")
+socket = LazyModule("socket")
+sqlite3 = LazyModule("sqlite3")
+ssl = LazyModule("ssl")
+urllib3 = LazyModule("urllib3")
+ElementTree = LazyModule("xml.etree.ElementTree")
+
+
+# Shared keep-alive session used for every HTTP call; main sizes it via create_session.
+HTTP_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+# Payload of the "success" test, also the request driven by the load modes.
+SUCCESS_PAYLOAD = {
+    "threadId": "test-thread-001",
+    "messages": [{"role": "user", "content": "Say 'Hello test' and nothing else."}],
+}
+
+
+# Set by main from --stream: the success test reads the reply incrementally and
+# stops once STREAM_MIN_TOKENS content tokens have arrived (see stream_chat_request).
+STREAM_RESPONSES = False
+STREAM_MIN_TOKENS = 20
+
+# Most bytes of a response body kept in memory; the rest is left unread and the
+# connection dropped, so a runaway reply cannot exhaust memory under load.
+MAX_RESPONSE_BYTES = 1024 * 1024
+
+
+# The listing for test functions, filled by register_cli_name factory.
+TEST_FUNCS = {}
+def register_cli_name(cli_name: str, display_name: str):
+    def decorator(func):
+        TEST_FUNCS[cli_name] = (func, display_name)
+        return func
+    return decorator
+
+
+# Native async implementations of tests, keyed like TEST_FUNCS; --async runs these
+# on one event loop and hands any test without one to a worker thread.
+ASYNC_TEST_FUNCS = {}
+def register_async_cli_name(cli_name: str, display_name: str):
+    """Register an ``async def`` test for the --async runner.
+
+    A test with no sync counterpart is also listed in TEST_FUNCS, so the sync
+    runners can call it through call_test.
+    """
+    def decorator(func):
+        if not inspect.iscoroutinefunction(func):
+            raise TypeError(f"{func.__name__} must be an async def to use register_async_cli_name")
+        ASYNC_TEST_FUNCS[cli_name] = (func, display_name)
+        TEST_FUNCS.setdefault(cli_name, (func, display_name))
+        return func
+    return decorator
+
+
+def get_api_key() -> str:
+    """Retrieve API key from environment variable."""
+    api_key = os.environ.get("API_KEY")
+    if not api_key:
+        raise EnvironmentError(
+            "API_KEY environment variable is not set.\n"
+            "Set it with: export API_KEY=your_api_key"
+        )
+    return api_key
+
+
+def get_api_url(env: str) -> str:
+    """Retrieve API URL from environment variable based on environment."""
+    if env == "prod":
+        url = os.environ.get("PROD_API_URL")
+        if not url:
+            raise EnvironmentError(
+                "PROD_API_URL environment variable is not set.\n"
+                "Set it with: export PROD_API_URL=your_prod_url"
+            )
+    else:
+        url = os.environ.get("TEST_API_URL")
+        if not url:
+            raise EnvironmentError(
+                "TEST_API_URL environment variable is not set.\n"
+                "Set it with: export TEST_API_URL=your_test_url"
+            )
+    return url
+
+
+def create_session(pool_size: int = 10, phase_timing: bool = False) -> requests.Session:
+    """Create a keep-alive session with room for pool_size concurrent connections per host.
+
+    With phase_timing, requests sent through send_request also record how long
+    DNS, connect, TLS, time-to-first-byte and the body read took.
+    """
+    session = requests.Session()
+    adapter_class = phase_timing_adapter() if phase_timing else requests.adapters.HTTPAdapter
+    adapter = adapter_class(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.phase_timing = phase_timing
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the shared session, creating a default one on first use."""
+    global HTTP_SESSION
+    if HTTP_SESSION is None:
+        with _SESSION_LOCK:
+            if HTTP_SESSION is None:
+                HTTP_SESSION = create_session()
+    return HTTP_SESSION
+
+
+def connection_stats(session: requests.Session, since: dict | None = None, extra: dict | None = None) -> dict:
+    """Count connections opened vs requests sent across the session's connection pools.
+
+    With since (an earlier result), only count what happened after it. extra adds
+    {"opened", "requests"} counts from outside the session, e.g. an AsyncHTTPClient.
+    """
+    stats = {"opened": 0, "requests": 0}
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats["opened"] += pool.num_connections
+                stats["requests"] += pool.num_requests
+    if since:
+        stats = {key: stats[key] - since[key] for key in stats}
+    if extra:
+        stats = {key: stats[key] + extra[key] for key in stats}
+    stats["reused"] = max(stats["requests"] - stats["opened"], 0)
+    return stats
+
+
+class LatencyHistogram:
+    """Fixed-memory, mergeable latency histogram with HDR-style buckets.
+
+    Values are recorded in microseconds. Each power-of-two range is split into the
+    same number of linear sub-buckets, so every recorded value is kept to within
+    `significant_figures` decimal digits of precision while the memory used stays
+    constant no matter how many values are recorded. Values above `max_seconds` are
+    clamped into the top bucket.
+    """
+
+    def __init__(self, significant_figures: int = 2, max_seconds: float = 3600.0):
+        self.significant_figures = significant_figures
+        self.max_value = int(max_seconds * 1_000_000)
+        self._sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self._sub_bucket_count = 1 << self._sub_bucket_bits
+        self._sub_bucket_half = self._sub_bucket_count // 2
+        bucket_count = max(self.max_value.bit_length() - self._sub_bucket_bits, 0) + 1
+        self.counts = [0] * ((bucket_count + 1) * self._sub_bucket_half)
+        self.total = 0
+        self.min_value = None
+        self.max_recorded = 0
+        self.sum_value = 0
+
+    def _index(self, value: int) -> int:
+        bucket = max(value.bit_length() - self._sub_bucket_bits, 0)
+        sub_bucket = value >> bucket
+        return (bucket + 1) * self._sub_bucket_half + sub_bucket - self._sub_bucket_half
+
+    def _value_at(self, index: int) -> int:
+        """Midpoint of the range of values that share the counts slot `index`."""
+        if index < self._sub_bucket_count:
+            return index
+        bucket = index // self._sub_bucket_half - 1
+        sub_bucket = index % self._sub_bucket_half + self._sub_bucket_half
+        return (sub_bucket << bucket) + ((1 << bucket) >> 1)
+
+    def record(self, seconds: float, count: int = 1):
+        """Record a latency given in seconds."""
+        value = min(max(int(seconds * 1_000_000), 0), self.max_value)
+        self.counts[self._index(value)] += count
+        self.total += count
+        self.sum_value += value * count
+        self.max_recorded = max(self.max_recorded, value)
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add the counts of another histogram with the same layout into this one."""
+        if len(other.counts) != len(self.counts) or other.significant_figures != self.significant_figures:
+            raise ValueError("Cannot merge histograms with different layouts")
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum_value += other.sum_value
+        self.max_recorded = max(self.max_recorded, other.max_recorded)
+        if other.min_value is not None:
+            self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+
+    def percentile(self, pct: float) -> float:
+        """Latency in seconds at or below which `pct` percent of recorded values fall."""
+        if not self.total:
+            return 0.0
+        if pct >= 100:
+            return self.max_recorded / 1_000_000
+        target = max(math.ceil(pct / 100 * self.total), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._value_at(index), self.max_recorded) / 1_000_000
+        return self.max_recorded / 1_000_000
+
+    @property
+    def mean(self) -> float:
+        return self.sum_value / self.total / 1_000_000 if self.total else 0.0
+
+    def to_dict(self) -> dict:
+        """JSON-friendly form keeping only non-zero counts; see from_dict."""
+        return {
+            "significant_figures": self.significant_figures,
+            "max_value": self.max_value,
+            "counts": {str(index): count for index, count in enumerate(self.counts) if count},
+            "total": self.total,
+            "min": self.min_value,
+            "max": self.max_recorded,
+            "sum": self.sum_value,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        """Rebuild a histogram saved with to_dict."""
+        histogram = cls(data["significant_figures"], data["max_value"] / 1_000_000)
+        for index, count in data["counts"].items():
+            histogram.counts[int(index)] = count
+        histogram.total = data["total"]
+        histogram.min_value = data["min"]
+        histogram.max_recorded = data["max"]
+        histogram.sum_value = data["sum"]
+        return histogram
+
+    def cumulative_counts(self, bounds) -> list:
+        """Count values at or below each of the ascending bounds (in seconds), in one pass."""
+        limits = [bound * 1_000_000 for bound in bounds]
+        cumulative = [0] * len(limits)
+        position = 0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            value = self._value_at(index)
+            while position < len(limits) and value > limits[position]:
+                cumulative[position] = seen
+                position += 1
+            if position == len(limits):
+                break
+            seen += count
+        for remaining in range(position, len(limits)):
+            cumulative[remaining] = seen
+        return cumulative
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)) -> dict:
+        """Map each percentile, plus "max", to a latency in seconds."""
+        return {pct: self.percentile(pct) for pct in percentiles} | {"max": self.max_recorded / 1_000_000}
+
+
+# Latency histograms of every request sent while a test runs, keyed by
+# (TEST_FUNCS name, status code or None when the request failed).
+LATENCIES = {}
+_LATENCIES_LOCK = threading.Lock()
+_CURRENT_TEST = contextvars.ContextVar("current_test", default=None)
+
+
+@contextmanager
+def current_test(name: str):
+    """Attribute requests sent in this context (thread or task) to test `name`."""
+    token = _CURRENT_TEST.set(name)
+    try:
+        yield
+    finally:
+        _CURRENT_TEST.reset(token)
+
+
+def record_latency(seconds: float, status: int | None):
+    """Add one request latency to the histogram of the current test, if any."""
+    name = _CURRENT_TEST.get()
+    if name is None:
+        return
+    with _LATENCIES_LOCK:
+        histogram = LATENCIES.get((name, status))
+        if histogram is None:
+            histogram = LATENCIES[(name, status)] = LatencyHistogram()
+        histogram.record(seconds)
+
+
+PHASES = ("dns", "connect", "tls", "upload", "ttfb", "body")
+
+# Phase durations of the request in flight on this thread, filled in by the
+# phase-timing connection classes while send_request has one active.
+_ACTIVE_PHASES = contextvars.ContextVar("active_phases", default=None)
+# Requests sent by the current test ({"latency", "status_code", "response_bytes",
+# "phases"} each), while run_test collects them.
+_TEST_REQUESTS = contextvars.ContextVar("test_requests", default=None)
+
+# Phase histograms of every request sent while a test runs, keyed by (TEST_FUNCS name, phase).
+PHASE_LATENCIES = {}
+
+
+class _PhaseTimingConnectionMixin:
+    """Times DNS, TCP connect, TLS, upload and time-to-first-byte on a urllib3 connection.
+
+    upload is the time spent sending the request line, headers and body; ttfb is the
+    wait from then until the response headers arrive, i.e. mostly server time.
+    """
+
+    def _new_conn(self):
+        phases = _ACTIVE_PHASES.get()
+        if phases is None:
+            return super()._new_conn()
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            # Let urllib3 resolve again and raise its own NameResolutionError.
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        phases["dns"] = resolved - started
+
+        # Connect to the resolved addresses directly so the lookup is not repeated;
+        # the real host name is restored before TLS, which uses it for SNI.
+        dns_host = self._dns_host
+        try:
+            for position, (*_, sockaddr) in enumerate(addresses):
+                self._dns_host = sockaddr[0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except urllib3.exceptions.NewConnectionError:
+                    if position == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+        phases["connect"] = time.perf_counter() - resolved
+        return sock
+
+    def connect(self):
+        phases = _ACTIVE_PHASES.get()
+        started = time.perf_counter()
+        super().connect()
+        if phases is not None and isinstance(self, urllib3.connection.HTTPSConnection):
+            handshake = time.perf_counter() - started
+            phases["tls"] = max(handshake - phases.get("dns", 0.0) - phases.get("connect", 0.0), 0.0)
+
+    def request(self, *args, **kwargs):
+        if self.sock is None and _ACTIVE_PHASES.get() is not None:
+            # Over plain http, urllib3 only connects inside request(). Connect first, so
+            # upload does not also count the DNS and connect time _new_conn recorded.
+            self.connect()
+        started = time.perf_counter()
+        try:
+            return super().request(*args, **kwargs)
+        finally:
+            self._phase_request_sent = time.perf_counter()
+            phases = _ACTIVE_PHASES.get()
+            if phases is not None:
+                phases["upload"] = self._phase_request_sent - started
+
+    def getresponse(self):
+        response = super().getresponse()
+        phases = _ACTIVE_PHASES.get()
+        if phases is not None:
+            phases["ttfb"] = time.perf_counter() - self._phase_request_sent
+        return response
+
+
+@functools.cache
+def phase_timing_adapter() -> type:
+    """Build the HTTPAdapter class whose connections record per-phase timings (see send_request).
+
+    The classes subclass urllib3 and requests, so they are created on first use
+    rather than at import time, which would pull in the whole HTTP stack.
+    """
+    class PhaseTimingHTTPConnection(_PhaseTimingConnectionMixin, urllib3.connection.HTTPConnection):
+        pass
+
+    class PhaseTimingHTTPSConnection(_PhaseTimingConnectionMixin, urllib3.connection.HTTPSConnection):
+        pass
+
+    class PhaseTimingHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+        ConnectionCls = PhaseTimingHTTPConnection
+
+    class PhaseTimingHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+        ConnectionCls = PhaseTimingHTTPSConnection
+
+    class PhaseTimingAdapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": PhaseTimingHTTPConnectionPool,
+                "https": PhaseTimingHTTPSConnectionPool,
+            }
+
+    return PhaseTimingAdapter
+
+
+def record_phases(phases: dict):
+    """Add one request's phase durations to the current test's phase histograms."""
+    name = _CURRENT_TEST.get()
+    if name is None:
+        return
+    with _LATENCIES_LOCK:
+        for phase, seconds in phases.items():
+            histogram = PHASE_LATENCIES.get((name, phase))
+            if histogram is None:
+                histogram = PHASE_LATENCIES[(name, phase)] = LatencyHistogram()
+            histogram.record(seconds)
+
+
+def record_request(seconds: float, status: int | None, response_bytes: int = 0,
+                   phases: dict | None = None):
+    """Record one finished request: latency and phase histograms, plus the test's request log."""
+    record_latency(seconds, status)
+    if phases:
+        record_phases(phases)
+    collected = _TEST_REQUESTS.get()
+    if collected is not None:
+        collected.append({"latency": seconds, "status_code": status,
+                          "response_bytes": response_bytes, "phases": phases or None})
+
+
+@contextmanager
+def collect_requests():
+    """Collect the request_record entries of requests sent in this context; yields the list."""
+    collected = []
+    token = _TEST_REQUESTS.set(collected)
+    try:
+        yield collected
+    finally:
+        _TEST_REQUESTS.reset(token)
+
+
+def format_phases(phases: dict) -> str:
+    """Render a phase dict as "dns=1.2ms connect=... body=...", in PHASES order."""
+    return " ".join(f"{phase}={phases[phase] * 1000:.1f}ms" for phase in PHASES if phase in phases)
+
+
+def read_body(response: requests.Response, limit: int) -> bytes:
+    """Read a streamed response body, keeping at most `limit` bytes.
+
+    The kept bytes become response.content. A longer body is cut off there, its
+    connection closed instead of drained, and response.truncated set.
+    """
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            break
+    content = b"".join(chunks)
+    response.truncated = size > limit
+    if response.truncated:
+        content = content[:limit]
+        response.close()
+    response._content = content
+    response._content_consumed = True
+    return content
+
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_SPACE = re.compile(r"\s*")
+# Strings are matched as runs of plain characters between escapes, which keeps the
+# regex engine from backtracking through a long (or cut off) string one character at a time.
+_JSON_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+# The start of a JSON value: a whole string or scalar, or the bracket opening a container.
+_JSON_VALUE_START = re.compile(_JSON_STRING + r'|[-+.\w]+|[\[{]')
+_JSON_CONTAINER_TOKEN = re.compile(_JSON_STRING + r'|[\[\]{}]')
+
+
+def _skip_json_value(text: str, position: int) -> int:
+    """Return the index just past the JSON value at `position`, without decoding it."""
+    match = _JSON_VALUE_START.match(text, position)
+    if match is None:
+        raise ValueError("expected a JSON value")
+    if match.group() not in ("[", "{"):
+        return match.end()
+    depth = 0
+    for token in _JSON_CONTAINER_TOKEN.finditer(text, position):
+        if token.group() in ("[", "{"):
+            depth += 1
+        elif token.group() in ("]", "}"):
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    raise ValueError("unterminated JSON value")
+
+
+def _scan_json_object(text: str, position: int, wanted: dict, found: dict, prefix: str = "") -> int | None:
+    """Walk the object at `position`, decoding only the wanted keys ("outer.inner" for nested ones).
+
+    Returns the index past the object, or None once a field that ends the scan
+    (wanted[path] is True) has been found.
+    """
+    position = _JSON_SPACE.match(text, position).end()
+    if text[position:position + 1] != "{":
+        raise ValueError("expected a JSON object")
+    position += 1
+    while True:
+        position = _JSON_SPACE.match(text, position).end()
+        if text[position:position + 1] == "}":
+            return position + 1
+        key, position = _JSON_DECODER.raw_decode(text, position)
+        position = _JSON_SPACE.match(text, text.index(":", position) + 1).end()
+        path = prefix + key
+        if path in wanted:
+            found[path], position = _JSON_DECODER.raw_decode(text, position)
+            if wanted[path]:
+                return None
+        elif text[position:position + 1] == "{" and any(name.startswith(path + ".") for name in wanted):
+            position = _scan_json_object(text, position, wanted, found, path + ".")
+            if position is None:
+                return None
+        else:
+            position = _skip_json_value(text, position)
+        position = _JSON_SPACE.match(text, position).end()
+        if text[position:position + 1] == ",":
+            position += 1
+
+
+def reply_fields(content: bytes) -> dict | None:
+    """Pick `assistant.content`, `error` and `message` out of a JSON reply.
+
+    Only those values are decoded; everything else is skipped over, and scanning
+    stops as soon as `assistant.content` or `error` is found. A body cut short (see
+    read_body) yields whatever was found before the cut. Returns None when the body
+    does not start as a JSON object.
+    """
+    text = content.decode("utf-8", errors="replace")
+    found = {}
+    # True marks the fields that end the scan.
+    wanted = {"assistant.content": True, "error": True, "message": False}
+    try:
+        _scan_json_object(text, 0, wanted, found)
+    except (ValueError, IndexError):
+        if not text.lstrip().startswith("{"):
+            return None
+    return {name.rsplit(".", 1)[-1]: value for name, value in found.items()}
+
+
+def response_preview(response, limit: int = 500) -> str:
+    """Decode at most `limit` bytes of a response body, for printing."""
+    content = response.content
+    cut = len(content) > limit or getattr(response, "truncated", False)
+    return content[:limit].decode("utf-8", errors="replace") + ("..." if cut else "")
+
+
+def send_request(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request on the shared session, recording its wall-clock latency.
+
+    The body is streamed in by read_body, keeping at most MAX_RESPONSE_BYTES. When
+    the session was created with phase_timing, its transfer is timed on its own.
+    """
+    session = get_session()
+    phases = {} if getattr(session, "phase_timing", False) else None
+    token = _ACTIVE_PHASES.set(phases)
+    started = time.perf_counter()
+    status = None
+    response_bytes = 0
+    try:
+        response = session.request(method, url, stream=True, **kwargs)
+        body_started = time.perf_counter()
+        read_body(response, MAX_RESPONSE_BYTES)
+        if phases is not None:
+            phases["body"] = time.perf_counter() - body_started
+        status = response.status_code
+        response_bytes = len(response.content)
+        return response
+    finally:
+        _ACTIVE_PHASES.reset(token)
+        record_request(time.perf_counter() - started, status, response_bytes, phases)
+
+
+# JSON codec for request bodies: "auto" (orjson when installed, else json), "json" or "orjson".
+JSON_CODEC = "auto"
+
+
+def _stdlib_json_dumps(value) -> bytes:
+    # Compact UTF-8, the same bytes orjson produces for the same value.
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+@functools.cache
+def json_codec(name: str) -> tuple:
+    """Return (dumps, loads) for a codec name; dumps returns bytes.
+
+    orjson is imported here rather than at startup, and only when asked for; an
+    explicit "orjson" raises ImportError when it is not installed.
+    """
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+        except ImportError:
+            if name == "orjson":
+                raise
+        else:
+            return orjson.dumps, orjson.loads
+    return _stdlib_json_dumps, json.loads
+
+
+def json_dumps(value) -> bytes:
+    """Encode a JSON value to bytes with the selected JSON_CODEC."""
+    return json_codec(JSON_CODEC)[0](value)
+
+
+@functools.cache
+def json_headers(api_key: str) -> types.MappingProxyType:
+    """Read-only request headers for api_key, built once and shared by every request."""
+    return types.MappingProxyType({
+        "Content-Type": "application/json",
+        "X-Api-Key": api_key,
+    })
+
+
+@functools.cache
+def success_body() -> bytes:
+    """SUCCESS_PAYLOAD encoded once, for the load modes that send it over and over."""
+    return json_dumps(SUCCESS_PAYLOAD)
+
+
+def make_request(
+    url: str,
+    api_key: str,
+    payload,
+    headers_override: dict | None = None,
+    verbose: bool = False,
+) -> requests.Response:
+    """Make a POST request to the API endpoint.
+
+    payload is a JSON value, or bytes already encoded with json_dumps so that
+    callers sending the same body repeatedly only encode it once.
+    """
+    headers = json_headers(api_key)
+    if headers_override:
+        headers = headers | headers_override
+    body = payload if isinstance(payload, bytes) else json_dumps(payload)
+
+    if verbose:
+        print(f"  URL: {url}")
+        print(f"  Headers: {json.dumps(dict(headers), indent=2)}")
+        print(f"  Payload: {body.decode('utf-8', 'replace')}")
+
+    response = send_request("POST", url, headers=headers, data=body, timeout=30)
+    return response
+
+
+# Streaming metrics of every streamed request sent while a test runs, keyed by
+# (TEST_FUNCS name, metric) with metric one of "ttfb", "ttft" and "tpot" (time per output token).
+STREAM_LATENCIES = {}
+
+
+def _stream_delta(event: str) -> str:
+    """Extract the content delta from one server-sent event's data."""
+    try:
+        data = json.loads(event)
+    except json.JSONDecodeError:
+        return event
+    if not isinstance(data, dict):
+        return data if isinstance(data, str) else ""
+    for path in (("assistant", "content"), ("delta", "content"), ("choices", 0, "delta", "content"),
+                 ("content",), ("token",), ("text",)):
+        value = data
+        try:
+            for key in path:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            continue
+        if isinstance(value, str):
+            return value
+    return ""
+
+
+def stream_chat_request(url: str, api_key: str, payload: dict, min_tokens: int = 0,
+                        verbose: bool = False) -> dict:
+    """POST payload and consume the reply incrementally, timing the first byte and token.
+
+    Server-sent events (text/event-stream) are read event by event, each non-empty
+    content delta counting as one token, and reading stops once min_tokens tokens
+    have arrived (0 reads to the end). Any other reply is read chunk by chunk until
+    complete, or until MAX_RESPONSE_BYTES are buffered, and its `assistant.content`
+    or `error` picked out by reply_fields; its first token is when the
+    `assistant.content` value starts arriving.
+
+    Returns a dict with status_code, content, tokens, ttfb, ttft, tokens_per_second
+    (None unless at least two tokens were streamed), complete (False when reading
+    stopped early), truncated (True when the byte cap stopped it), response_bytes
+    and, for non-SSE replies, the fields from reply_fields as `data`.
+    """
+    headers = json_headers(api_key) | {"Accept": "text/event-stream, application/json"}
+    body = json_dumps(payload)
+    if verbose:
+        print(f"  URL: {url}")
+        print(f"  Headers: {json.dumps(headers, indent=2)}")
+        print(f"  Payload: {body.decode('utf-8', 'replace')}")
+
+    result = {"status_code": None, "content": "", "tokens": 0, "ttfb": None, "ttft": None,
+              "tokens_per_second": None, "complete": True, "truncated": False, "data": None,
+              "response_bytes": 0}
+    session = get_session()
+    phases = {} if getattr(session, "phase_timing", False) else None
+    token = _ACTIVE_PHASES.set(phases)
+    started = time.perf_counter()
+    last_token_at = None
+    response = None
+    try:
+        response = session.post(url, headers=headers, data=body, timeout=30, stream=True)
+        result["status_code"] = response.status_code
+        result["ttfb"] = time.perf_counter() - started
+        is_sse = response.headers.get("Content-Type", "").startswith("text/event-stream")
+        buffer = b""
+        content_start = re.compile(rb'"content"\s*:\s*"')
+
+        # SSE is read as it arrives; other replies in bounded chunks, since chunk_size=None
+        # reads a whole Content-Length body in one go.
+        for chunk in response.iter_content(chunk_size=None if is_sse else 64 * 1024):
+            now = time.perf_counter()
+            result["response_bytes"] += len(chunk)
+            buffer += chunk
+            if len(buffer) > MAX_RESPONSE_BYTES:
+                # A runaway body (or an SSE line that never ends); stop before it fills memory.
+                buffer = buffer[:MAX_RESPONSE_BYTES]
+                result["complete"] = False
+                result["truncated"] = True
+                break
+            if not is_sse:
+                if result["ttft"] is None and content_start.search(buffer):
+                    result["ttft"] = now - started
+                continue
+
+            finished = False
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line = line.rstrip(b"\r")
+                if not line.startswith(b"data:"):
+                    continue
+                event = line[5:].strip().decode("utf-8", errors="replace")
+                if event == "[DONE]":
+                    finished = True
+                    break
+                delta = _stream_delta(event)
+                if not delta:
+                    continue
+                if result["ttft"] is None:
+                    result["ttft"] = now - started
+                last_token_at = now
+                result["tokens"] += 1
+                if len(result["content"]) < 500:
+                    result["content"] += delta
+                if min_tokens and result["tokens"] >= min_tokens:
+                    # Enough tokens to pass; skip the rest of the stream.
+                    result["complete"] = False
+                    finished = True
+                    break
+            if finished:
+                break
+
+        if not is_sse and buffer:
+            result["content"] = buffer[:500].decode("utf-8", errors="replace")
+            if response.status_code == 200:
+                result["data"] = reply_fields(buffer)
+                if result["data"] is None:
+                    raise ValueError("Reply is not a JSON object")
+                content = result["data"].get("content")
+                if isinstance(content, str):
+                    result["content"] = content
+                    result["tokens"] = len(content.split())
+        if result["tokens"] > 1 and is_sse:
+            result["tokens_per_second"] = (result["tokens"] - 1) / max(last_token_at - started - result["ttft"], 1e-9)
+        if phases is not None:
+            phases["body"] = time.perf_counter() - started - result["ttfb"]
+        return result
+    finally:
+        if response is not None:
+            response.close()
+        _ACTIVE_PHASES.reset(token)
+        record_request(time.perf_counter() - started, result["status_code"], result["response_bytes"], phases)
+        record_stream_metrics(result)
+
+
+def record_stream_metrics(result: dict):
+    """Add a stream_chat_request result to the current test's streaming histograms."""
+    name = _CURRENT_TEST.get()
+    if name is None:
+        return
+    metrics = {"ttfb": result["ttfb"], "ttft": result["ttft"]}
+    if result["tokens_per_second"]:
+        metrics["tpot"] = 1.0 / result["tokens_per_second"]
+    with _LATENCIES_LOCK:
+        for metric, seconds in metrics.items():
+            if seconds is None:
+                continue
+            histogram = STREAM_LATENCIES.get((name, metric))
+            if histogram is None:
+                histogram = STREAM_LATENCIES[(name, metric)] = LatencyHistogram()
+            histogram.record(seconds)
+
+
+class AsyncResponse:
+    """The parts of requests.Response that tests use, for AsyncHTTPClient replies."""
+
+    def __init__(self, status_code: int, reason: str, headers, content: bytes, truncated: bool = False):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.truncated = truncated
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHTTPClient:
+    """Minimal HTTP/1.1 keep-alive client on asyncio streams, used by async tests.
+
+    Failures are raised as requests.exceptions so async tests can share the
+    error handling of the sync ones.
+    """
+
+    def __init__(self, pool_size: int = 100, timeout: float = 30):
+        self.timeout = timeout
+        self.opened = 0
+        self.requests = 0
+        self._limit = asyncio.Semaphore(pool_size)
+        self._idle = {}
+        self._ssl_context = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, writer in connections:
+                writer.close()
+
+    async def _connect(self, parts: urllib.parse.SplitResult):
+        ssl_context = None
+        if parts.scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context(cafile=requests.certs.where())
+            ssl_context = self._ssl_context
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        connection = await asyncio.open_connection(parts.hostname, port, ssl=ssl_context)
+        self.opened += 1
+        return connection
+
+    async def _exchange(self, reader, writer, method: str, parts: urllib.parse.SplitResult,
+                        headers: dict, body: bytes):
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        if body or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(body)}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed before response")
+        _, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        response_headers = requests.structures.CaseInsensitiveDict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip()] = value.strip()
+
+        status_code = int(status)
+        keep_alive = response_headers.get("Connection", "").lower() != "close"
+        limit = MAX_RESPONSE_BYTES
+        truncated = False
+        if method == "HEAD" or status_code in (204, 304) or 100 <= status_code < 200:
+            content = b""
+        elif response_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            received = 0
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip trailers up to the terminating blank line.
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                if received + size > limit:
+                    chunks.append(await reader.readexactly(limit - received))
+                    truncated = True
+                    break
+                chunks.append(await reader.readexactly(size))
+                received += size
+                await reader.readexactly(2)
+            content = b"".join(chunks)
+        elif "Content-Length" in response_headers:
+            length = int(response_headers["Content-Length"])
+            truncated = length > limit
+            content = await reader.readexactly(min(length, limit))
+        else:
+            content = await reader.read(limit + 1)
+            truncated = len(content) > limit
+            content = content[:limit]
+            keep_alive = False
+        if truncated:
+            # The rest of the body is left unread, so the connection cannot be reused.
+            keep_alive = False
+
+        response = AsyncResponse(status_code, reason[0] if reason else "", response_headers, content, truncated)
+        return response, keep_alive
+
+    async def request(self, method: str, url: str, headers: dict | None = None,
+                      data: str | bytes | None = None, json_body=None,
+                      timeout: float | None = None) -> AsyncResponse:
+        """Send one request, reusing an idle keep-alive connection when there is one."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        headers = dict(headers or {})
+        if json_body is not None:
+            body = json_dumps(json_body)
+            headers.setdefault("Content-Type", "application/json")
+        elif isinstance(data, str):
+            body = data.encode("utf-8")
+        else:
+            body = data or b""
+
+        async with self._limit:
+            started = time.perf_counter()
+            idle = self._idle.get(key)
+            reused = bool(idle)
+            connection = idle.pop() if reused else None
+            try:
+                while True:
+                    if connection is None:
+                        connection = await asyncio.wait_for(self._connect(parts), timeout or self.timeout)
+                    try:
+                        response, keep_alive = await asyncio.wait_for(
+                            self._exchange(*connection, method, parts, headers, body),
+                            timeout or self.timeout,
+                        )
+                        break
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        # The server may have dropped an idle connection; retry once on a fresh one.
+                        connection[1].close()
+                        connection = None
+                        if not reused:
+                            raise
+                        reused = False
+            except asyncio.TimeoutError as e:
+                if connection is not None:
+                    connection[1].close()
+                record_request(time.perf_counter() - started, None)
+                raise requests.exceptions.Timeout(f"{method} {url} timed out") from e
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                if connection is not None:
+                    connection[1].close()
+                record_request(time.perf_counter() - started, None)
+                raise requests.exceptions.ConnectionError(f"{method} {url} failed: {e}") from e
+
+            record_request(time.perf_counter() - started, response.status_code, len(response.content))
+            self.requests += 1
+            if keep_alive:
+                self._idle.setdefault(key, []).append(connection)
+            else:
+                connection[1].close()
+            return response
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def options(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request("OPTIONS", url, **kwargs)
+
+
+# The AsyncHTTPClient for the running event loop, set by the async runners.
+_ASYNC_CLIENT = contextvars.ContextVar("async_client", default=None)
+
+
+def get_async_client() -> AsyncHTTPClient:
+    """Return the AsyncHTTPClient of the current async run."""
+    client = _ASYNC_CLIENT.get()
+    if client is None:
+        raise RuntimeError("No AsyncHTTPClient is active; run async tests through call_test")
+    return client
+
+
+async def async_make_request(
+    url: str,
+    api_key: str,
+    payload: dict,
+    headers_override: dict | None = None,
+    verbose: bool = False,
+) -> AsyncResponse:
+    """Async counterpart of make_request, using the active AsyncHTTPClient."""
+    headers = json_headers(api_key)
+    if headers_override:
+        headers = headers | headers_override
+    body = payload if isinstance(payload, bytes) else json_dumps(payload)
+
+    if verbose:
+        print(f"  URL: {url}")
+        print(f"  Headers: {json.dumps(dict(headers), indent=2)}")
+        print(f"  Payload: {body.decode('utf-8', 'replace')}")
+
+    return await get_async_client().post(url, headers=headers, data=body)
+
+
+# Outcome of the test running in this context, filled in by print_result for run_test.
+_TEST_OUTCOME = contextvars.ContextVar("test_outcome", default=None)
+
+# Table of declarative request/expected-response tests; see load_test_cases.
+TEST_CASES_PATH = os.environ.get(
+    "API_TEST_CASES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-cases.json"))
+
+# Headers every case starts from; "{api_key}" is filled in when the table is prepared.
+CASE_HEADERS = {
+    "Content-Type": "application/json",
+    "X-Api-Key": "{api_key}",
+}
+
+
+def load_test_cases(path: str) -> list:
+    """Read and check a test case table (.json, or .yaml/.yml when PyYAML is installed).
+
+    Each case is {"name", "display_name", "title"?, "request", "expect"}. request has
+    an optional "method" (default POST), either "json" (serialized once) or "body"
+    (sent as is; omit both for no body), and "headers" merged over CASE_HEADERS,
+    where null removes a header. expect has the "status" and optionally an "error"
+    fragment the JSON reply's "error" must contain ("" only requires the field).
+    """
+    with open(path, encoding="utf-8") as file:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"{path}: reading YAML needs PyYAML (pip install pyyaml)")
+            try:
+                cases = yaml.safe_load(file)
+            except yaml.YAMLError as e:
+                raise ValueError(f"{path}: {e}") from e
+        else:
+            try:
+                cases = json.load(file)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}: {e}") from e
+    if not isinstance(cases, list):
+        raise ValueError(f"{path}: expected a list of test cases")
+    names = set()
+    for position, case in enumerate(cases, start=1):
+        case_id = f"{path}: test case {position}"
+        if not isinstance(case, dict):
+            raise ValueError(f"{case_id}: expected an object")
+        if not isinstance(case.get("name"), str) or not case["name"]:
+            raise ValueError(f"{case_id}: needs a name")
+        case_id += f" ({case['name']})"
+        if case["name"] in names:
+            raise ValueError(f"{case_id}: duplicate name")
+        names.add(case["name"])
+        if not isinstance(case.get("display_name"), str) or not case["display_name"]:
+            raise ValueError(f"{case_id}: needs a display_name")
+        if not isinstance(case.get("title", ""), str):
+            raise ValueError(f"{case_id}: title must be a string")
+        request = case.get("request", {})
+        if not isinstance(request, dict):
+            raise ValueError(f"{case_id}: request must be an object")
+        if not isinstance(request.get("method", "POST"), str):
+            raise ValueError(f"{case_id}: request.method must be a string")
+        if "json" in request and "body" in request:
+            raise ValueError(f"{case_id}: use at most one of request.json and request.body")
+        if not isinstance(request.get("body", ""), str):
+            raise ValueError(f"{case_id}: request.body must be a string")
+        headers = request.get("headers", {})
+        if not isinstance(headers, dict) or not all(
+                isinstance(value, str) or value is None for value in headers.values()):
+            raise ValueError(f"{case_id}: request.headers must map names to strings (or null to remove)")
+        expect = case.get("expect")
+        if not isinstance(expect, dict):
+            raise ValueError(f"{case_id}: needs an expect object")
+        if not isinstance(expect.get("status"), int) or isinstance(expect["status"], bool):
+            raise ValueError(f"{case_id}: expect.status must be an integer")
+        if expect.get("error") is not None and not isinstance(expect["error"], str):
+            raise ValueError(f"{case_id}: expect.error must be a string")
+    return cases
+
+
+class PreparedCase:
+    """A test case compiled for one API key: body bytes and headers built once, reused every run."""
+
+    __slots__ = ("name", "display_name", "title", "method", "headers", "body", "status", "error")
+
+    def __init__(self, case: dict, api_key: str):
+        request = case.get("request", {})
+        self.name = case["name"]
+        self.display_name = case["display_name"]
+        self.title = case.get("title", case["display_name"])
+        self.method = request.get("method", "POST")
+        headers = CASE_HEADERS | request.get("headers", {})
+        self.headers = {name: value.replace("{api_key}", api_key)
+                        for name, value in headers.items() if value is not None}
+        if "json" in request:
+            self.body = json_dumps(request["json"])
+        else:
+            self.body = request.get("body", "").encode("utf-8") if "body" in request else None
+        self.status = case["expect"]["status"]
+        self.error = case["expect"].get("error")
+
+    def _print_request(self, url: str, verbose: bool):
+        print(f"\n--- Test: {self.title} ---")
+        if verbose:
+            print(f"  URL: {url}")
+            print(f"  Headers: {json.dumps(self.headers, indent=2)}")
+            print(f"  Body: {self.body.decode('utf-8', 'replace') if self.body is not None else '(none)'}")
+
+    def check(self, response, verbose: bool = False) -> bool:
+        """Check a response (requests.Response or AsyncResponse) against the expectation."""
+        if verbose:
+            print(f"  Status Code: {response.status_code}")
+            print(f"  Response: {response_preview(response)}")
+
+        if response.status_code != self.status:
+            print_result(self.display_name, False, f"Expected {self.status}, got {response.status_code}")
+            return False
+        error = (reply_fields(response.content) or {}).get("error")
+        if self.error is None:
+            detail = f"Got expected error: {error}" if isinstance(error, str) else f"Got expected {response.status_code} {response.reason}"
+            print_result(self.display_name, True, detail)
+            return True
+        if not isinstance(error, str):
+            print_result(self.display_name, False, "Expected error message in response")
+            return False
+        if self.error not in error:
+            print_result(self.display_name, False, f"Unexpected error: {error}")
+            return False
+        print_result(self.display_name, True, f"Got expected error: {error}")
+        return True
+
+    def run(self, url: str, verbose: bool = False) -> bool:
+        self._print_request(url, verbose)
+        try:
+            response = send_request(self.method, url, headers=self.headers, data=self.body, timeout=30)
+        except requests.exceptions.RequestException as e:
+            print_result(self.display_name, False, f"Request failed: {e}")
+            return False
+        return self.check(response, verbose)
+
+    async def run_async(self, url: str, verbose: bool = False) -> bool:
+        self._print_request(url, verbose)
+        try:
+            response = await get_async_client().request(self.method, url, headers=self.headers,
+                                                        data=self.body, timeout=30)
+        except requests.exceptions.RequestException as e:
+            print_result(self.display_name, False, f"Request failed: {e}")
+            return False
+        return self.check(response, verbose)
+
+
+# Registered case dicts, and their PreparedCase objects compiled per API key.
+TEST_CASES = []
+_PREPARED_CASES = {}
+
+
+def prepare_test_cases(api_key: str) -> dict:
+    """Compile the registered cases for api_key on first use; returns {name: PreparedCase}."""
+    prepared = _PREPARED_CASES.get(api_key)
+    if prepared is None:
+        prepared = _PREPARED_CASES[api_key] = {case["name"]: PreparedCase(case, api_key) for case in TEST_CASES}
+    return prepared
+
+
+def register_test_cases(cases: list):
+    """Register every case in the table as a test, in table order, at _TABLE_POSITION in TEST_FUNCS.
+
+    The cases replace any registered before, so loading the table again is harmless.
+    """
+    def make_tests(name: str):
+        def test(url: str, api_key: str, verbose: bool = False) -> bool:
+            return prepare_test_cases(api_key)[name].run(url, verbose)
+
+        async def test_async(url: str, api_key: str, verbose: bool = False) -> bool:
+            return await prepare_test_cases(api_key)[name].run_async(url, verbose)
+
+        test.__name__ = f"test_{name.replace('-', '_')}"
+        test_async.__name__ = f"{test.__name__}_async"
+        test.__doc__ = test_async.__doc__ = f"Test case {name!r} from the test case table."
+        return test, test_async
+
+    for case in TEST_CASES:
+        TEST_FUNCS.pop(case["name"], None)
+        ASYNC_TEST_FUNCS.pop(case["name"], None)
+    TEST_CASES[:] = cases
+    _PREPARED_CASES.clear()
+    registered = list(TEST_FUNCS.items())
+    TEST_FUNCS.clear()
+    TEST_FUNCS.update(registered[:_TABLE_POSITION])
+    for case in cases:
+        test, test_async = make_tests(case["name"])
+        register_cli_name(case["name"], case["display_name"])(test)
+        register_async_cli_name(case["name"], case["display_name"])(test_async)
+    TEST_FUNCS.update(registered[_TABLE_POSITION:])
+
+
+def print_result(test_name: str, passed: bool, details: str = ""):
+    """Print test result with consistent formatting."""
+    outcome = _TEST_OUTCOME.get()
+    if outcome is not None:
+        outcome.update(passed=passed, details=details)
+    status = "✅ PASS" if passed else "❌ FAIL"
+    print(f"{status} - {test_name}")
+    if details:
+        print(f"       {details}")
+
+
+@register_cli_name("success", "Success Request")
+def test_success_request(url: str, api_key: str, verbose: bool = False) -> bool:
+    """Test a valid request that should succeed."""
+    print("\n--- Test: Valid Request (Success) ---")
+    payload = SUCCESS_PAYLOAD
+    if STREAM_RESPONSES:
+        return _test_success_streaming(url, api_key, payload, verbose)
+
+    try:
+        response = make_request(url, api_key, payload, verbose=verbose)
+    except requests.exceptions.Timeout:
+        print_result("Valid Request", False, "Request timed out")
+        return False
+    except requests.exceptions.RequestException as e:
+        print_result("Valid Request", False, f"Request failed: {e}")
+        return False
+    return _check_success_response(response, verbose)
+
+
+@register_async_cli_name("success", "Success Request")
+async def test_success_request_async(url: str, api_key: str, verbose: bool = False) -> bool:
+    """Async variant of test_success_request, run by --async."""
+    print("\n--- Test: Valid Request (Success) ---")
+    if STREAM_RESPONSES:
+        # stream_chat_request reads on the shared session; keep it off the event loop.
+        return await asyncio.to_thread(_test_success_streaming, url, api_key, SUCCESS_PAYLOAD, verbose)
+
+    try:
+        response = await async_make_request(url, api_key, success_body(), verbose=verbose)
+    except requests.exceptions.Timeout:
+        print_result("Valid Request", False, "Request timed out")
+        return False
+    except requests.exceptions.RequestException as e:
+        print_result("Valid Request", False, f"Request failed: {e}")
+        return False
+    return _check_success_response(response, verbose)
+
+
+def _check_success_response(response, verbose: bool = False) -> bool:
+    """Check the reply to the success payload (requests.Response or AsyncResponse)."""
+    if verbose:
+        print(f"  Status Code: {response.status_code}")
+        print(f"  Response: {response_preview(response)}")
+
+    if response.status_code != 200:
+        print_result("Valid Request", False, f"Expected 200, got {response.status_code}")
+        return False
+    data = reply_fields(response.content)
+    if data is None:
+        print_result("Valid Request", False, "Invalid JSON response")
+        return False
+    if isinstance(data.get("content"), str):
+        print_result("Valid Request", True, f"Got response: {data['content'][:50]}...")
+        return True
+    details = "Missing 'assistant.content' in response"
+    if response.truncated:
+        details += f" (body cut off at {_format_size(MAX_RESPONSE_BYTES)})"
+    print_result("Valid Request", False, details)
+    return False
+
+
+def _test_success_streaming(url: str, api_key: str, payload: dict, verbose: bool = False) -> bool:
+    """Streaming variant of test_success_request, used with --stream."""
+    try:
+        result = stream_chat_request(url, api_key, payload, STREAM_MIN_TOKENS, verbose=verbose)
+
+        timing = f"TTFB {result['ttfb'] * 1000:.0f}ms"
+        if result["ttft"] is not None:
+            timing += f", TTFT {result['ttft'] * 1000:.0f}ms"
+        if result["tokens_per_second"]:
+            timing += f", {result['tokens_per_second']:.1f} tokens/s"
+        if verbose:
+            print(f"  Status Code: {result['status_code']}")
+            print(f"  Response: {result['content'][:500]}...")
+            state = "complete" if result["complete"] else "cut off" if result["truncated"] else "stopped early"
+            print(f"  Tokens: {result['tokens']} ({state})")
+
+        if result["status_code"] != 200:
+            print_result("Valid Request", False, f"Expected 200, got {result['status_code']}")
+            return False
+        if not result["tokens"] and result["data"] is None:
+            print_result("Valid Request", False, "No content tokens in streamed response")
+            return False
+        if result["data"] is not None and not isinstance(result["data"].get("content"), str):
+            details = "Missing 'assistant.content' in response"
+            if result["truncated"]:
+                details += f" (body cut off at {_format_size(MAX_RESPONSE_BYTES)})"
+            print_result("Valid Request", False, details)
+            return False
+        print_result("Valid Request", True, f"Got response: {result['content'][:50]}... ({timing})")
+        return True
+
+    except requests.exceptions.Timeout:
+        print_result("Valid Request", False, "Request timed out")
+        return False
+    except requests.exceptions.RequestException as e:
+        print_result("Valid Request", False, f"Request failed: {e}")
+        return False
+    except ValueError as e:
+        print_result("Valid Request", False, f"Invalid JSON response: {e}")
+        return False
+
+
+# The table is loaded by parse_args, so a broken table is reported as an argument
+# error; its tests go here, between success and cors.
+_TABLE_POSITION = len(TEST_FUNCS)
+
+
+CORS_PREFLIGHT_HEADERS = {
+    "Access-Control-Request-Method": "POST",
+    "Origin": "http://localhost:5173",
+}
+
+
+@register_cli_name("cors", "CORS Preflight")
+def test_cors_preflight(url: str, api_key: str, verbose: bool = False) -> bool:
+    """Test CORS preflight OPTIONS request."""
+    print("\n--- Test: CORS Preflight (OPTIONS) ---")
+    try:
+        response = send_request("OPTIONS", url, headers=CORS_PREFLIGHT_HEADERS, timeout=30)
+    except requests.exceptions.RequestException as e:
+        print_result("CORS Preflight", False, f"Request failed: {e}")
+        return False
+    return _check_cors_response(response, verbose)
+
+
+@register_async_cli_name("cors", "CORS Preflight")
+async def test_cors_preflight_async(url: str, api_key: str, verbose: bool = False) -> bool:
+    """Async variant of test_cors_preflight, run by --async."""
+    print("\n--- Test: CORS Preflight (OPTIONS) ---")
+    try:
+        response = await get_async_client().options(url, headers=CORS_PREFLIGHT_HEADERS, timeout=30)
+    except requests.exceptions.RequestException as e:
+        print_result("CORS Preflight", False, f"Request failed: {e}")
+        return False
+    return _check_cors_response(response, verbose)
+
+
+def _check_cors_response(response, verbose: bool = False) -> bool:
+    """Check a preflight reply (requests.Response or AsyncResponse) for CORS headers."""
+    if verbose:
+        print(f"  Status Code: {response.status_code}")
+        print(f"  Headers: {dict(response.headers)}")
+
+    if response.status_code == 200:
+        cors_origin = response.headers.get("Access-Control-Allow-Origin", "")
+        cors_methods = response.headers.get("Access-Control-Allow-Methods", "")
+
+        if cors_origin and cors_methods:
+            print_result("CORS Preflight", True, f"Origin: {cors_origin}, Methods: {cors_methods}")
+            return True
+        else:
+            print_result("CORS Preflight", False, "Missing CORS headers in response")
+            return False
+    else:
+        print_result("CORS Preflight", False, f"Expected 200, got {response.status_code}")
+        return False
+
+
+class ContextStdout:
+    """Stand-in for sys.stdout that diverts writes to a per-context buffer while capturing.
+
+    The buffer lives in a ContextVar, so captures are independent per thread and per
+    asyncio task, and follow work handed off with asyncio.to_thread.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = contextvars.ContextVar("stdout_buffer", default=None)
+
+    def write(self, text: str) -> int:
+        return (self._buffer.get() or self._stream).write(text)
+
+    def flush(self):
+        if self._buffer.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    @contextmanager
+    def capture(self):
+        """Buffer everything the current context prints; yields the buffer."""
+        buffer = io.StringIO()
+        token = self._buffer.set(buffer)
+        try:
+            yield buffer
+        finally:
+            self._buffer.reset(token)
+
+
+@contextmanager
+def buffered_stdout():
+    """Install a ContextStdout as sys.stdout for the duration of a concurrent run."""
+    if isinstance(sys.stdout, ContextStdout):
+        yield sys.stdout
+        return
+    previous_stdout = sys.stdout
+    sys.stdout = stdout = ContextStdout(previous_stdout)
+    try:
+        yield stdout
+    finally:
+        sys.stdout = previous_stdout
+
+
+async def _call_async_test(test_func, url: str, api_key: str, verbose: bool):
+    """Run an async test on a fresh event loop with its own AsyncHTTPClient."""
+    async with AsyncHTTPClient() as client:
+        _ASYNC_CLIENT.set(client)
+        return await test_func(url, api_key, verbose)
+
+
+def call_test(test_func, url: str, api_key: str, verbose: bool = False):
+    """Call a registered test from synchronous code, whether it is sync or async."""
+    if inspect.iscoroutinefunction(test_func):
+        return asyncio.run(_call_async_test(test_func, url, api_key, verbose))
+    return test_func(url, api_key, verbose)
+
+
+def _test_record(name: str, passed: bool, started_at: datetime, duration: float,
+                 requests_sent: list, outcome: dict) -> dict:
+    """Build the result record of one test run (see run_test)."""
+    last = requests_sent[-1] if requests_sent else {}
+    return {
+        "name": name,
+        "display_name": TEST_FUNCS[name][1],
+        "status": "passed" if passed else "failed",
+        "passed": passed,
+        "timestamp": started_at.isoformat(),
+        "duration_ms": round(duration * 1000, 3),
+        "latency_ms": round(sum(request["latency"] for request in requests_sent) * 1000, 3),
+        "status_code": last.get("status_code"),
+        "response_bytes": sum(request["response_bytes"] for request in requests_sent),
+        "requests": len(requests_sent),
+        "error": None if passed else outcome.get("details") or "Test failed",
+    }
+
+
+def _print_request_phases(requests_sent: list):
+    """Print the --phases breakdown of each request a test sent (verbose mode)."""
+    for request in requests_sent:
+        if request["phases"]:
+            print(f"  Phases: {format_phases(request['phases'])}")
+
+
+def run_test(name: str, url: str, api_key: str, verbose: bool = False) -> dict:
+    """Run the registered test `name`, turning unexpected exceptions into a failure.
+
+    Returns the test's result record: name, display_name, status/passed, timestamp,
+    duration_ms, latency_ms (summed over its requests), status_code (of its last
+    request), response_bytes, requests and error (the failure details, else None).
+    """
+    test_func, display_name = TEST_FUNCS[name]
+    outcome = {}
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    outcome_token = _TEST_OUTCOME.set(outcome)
+    try:
+        with current_test(name), collect_requests() as requests_sent:
+            passed = bool(call_test(test_func, url, api_key, verbose))
+    except Exception as e:
+        print_result(display_name, False, f"Unexpected error: {e}")
+        passed = False
+    finally:
+        _TEST_OUTCOME.reset(outcome_token)
+    if verbose:
+        _print_request_phases(requests_sent)
+    return _test_record(name, passed, started_at, time.perf_counter() - started, requests_sent, outcome)
+
+
+async def run_test_async(name: str, url: str, api_key: str, verbose: bool = False) -> dict:
+    """Like run_test, for the ASYNC_TEST_FUNCS test `name` run on the current event loop."""
+    test_func, display_name = ASYNC_TEST_FUNCS[name]
+    outcome = {}
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    outcome_token = _TEST_OUTCOME.set(outcome)
+    try:
+        with current_test(name), collect_requests() as requests_sent:
+            passed = bool(await test_func(url, api_key, verbose))
+    except Exception as e:
+        print_result(display_name, False, f"Unexpected error: {e}")
+        passed = False
+    finally:
+        _TEST_OUTCOME.reset(outcome_token)
+    if verbose:
+        _print_request_phases(requests_sent)
+    return _test_record(name, passed, started_at, time.perf_counter() - started, requests_sent, outcome)
+
+
+def _run_test_buffered(stdout: ContextStdout, name: str, url: str, api_key: str,
+                       verbose: bool) -> tuple[dict, str]:
+    """Run a test on a worker thread, returning its result record and captured output."""
+    with stdout.capture() as buffer:
+        record = run_test(name, url, api_key, verbose)
+    return record, buffer.getvalue()
+
+
+def parse_warmup(value: str) -> tuple[str, float]:
+    """Parse --warmup: a whole count of rounds ("3") or a duration with its unit ("1.5s", "2m")."""
+    text = value.strip()
+    if text.isdigit():
+        if int(text) < 1:
+            raise argparse.ArgumentTypeError("warmup rounds must be at least 1")
+        return "rounds", int(text)
+    if text[-1:].lower() not in ("s", "m", "h"):
+        raise argparse.ArgumentTypeError(
+            f"invalid warmup: {value!r} (a whole number of rounds, or a duration with a unit such as 1.5s or 2m)")
+    return "duration", parse_duration(text)
+
+
+def run_warmup(url: str, api_key: str, warmup: tuple[str, float], workers: int = 1,
+               loop=None, client: AsyncHTTPClient | None = None) -> dict:
+    """Run the registered tests to warm connections, DNS and backend instances, then discard the timings.
+
+    warmup is ("rounds", N) for N passes over TEST_FUNCS or ("duration", seconds)
+    to keep going until that much time has passed. Each pass runs every test once,
+    on up to `workers` threads. The pool is filled first by `workers` concurrent
+    HEAD requests (see open_connections), so a large pool does not mean repeating
+    the success request, which costs a model call. With client, an AsyncHTTPClient
+    driven on loop, both go through that client instead, so an --async run measures
+    on the connections the warmup opened. Output and latency statistics of the
+    warmup are dropped. Returns {"tests", "failed", "elapsed"}.
+    """
+    kind, amount = warmup
+    summary = {"tests": 0, "failed": 0}
+    started = time.perf_counter()
+    with buffered_stdout() as stdout, stdout.capture():
+        if client is not None:
+            loop.run_until_complete(open_connections_async(client, url, workers))
+        else:
+            open_connections(url, workers)
+        rounds = 0
+        while rounds < amount if kind == "rounds" else time.perf_counter() - started < amount:
+            rounds += 1
+            if client is not None:
+                run = loop.run_until_complete(run_all_tests_async(url, api_key, False, workers, client=client))
+            else:
+                run = run_all_tests(url, api_key, False, min(workers, len(TEST_FUNCS)))
+            summary["tests"] += run["passed"] + run["failed"]
+            summary["failed"] += run["failed"]
+    summary["elapsed"] = time.perf_counter() - started
+    reset_measurements()
+    return summary
+
+
+def open_connections(url: str, count: int):
+    """Open up to count pooled connections to url with concurrent HEAD requests.
+
+    Each response is held open until all have arrived, so no request can reuse
+    another's connection. Failures are ignored; the tests will report them.
+    """
+    arrived = threading.Barrier(count)
+
+    def head(_):
+        try:
+            response = HTTP_SESSION.head(url, timeout=5, stream=True)
+        except requests.exceptions.RequestException:
+            arrived.abort()
+            return
+        try:
+            arrived.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+        # Reading the (empty) body hands the connection back to the pool; close() would drop it.
+        response.content
+
+    with futures.ThreadPoolExecutor(max_workers=count, thread_name_prefix="api-warmup") as pool:
+        list(pool.map(head, range(count)))
+
+
+async def open_connections_async(client: AsyncHTTPClient, url: str, count: int):
+    """open_connections for an AsyncHTTPClient: count HEAD requests in flight at once."""
+    await asyncio.gather(*(client.request("HEAD", url, timeout=5) for _ in range(count)),
+                         return_exceptions=True)
+
+
+def reset_measurements():
+    """Forget every latency, phase and streaming measurement recorded so far."""
+    with _LATENCIES_LOCK:
+        LATENCIES.clear()
+        PHASE_LATENCIES.clear()
+        STREAM_LATENCIES.clear()
+
+
+def _record_result(results: dict, record: dict, on_record=None):
+    """Add one test result record to a run_all_tests summary dict."""
+    if record["passed"]:
+        results["passed"] += 1
+    else:
+        results["failed"] += 1
+    results["details"].append((record["display_name"], record["passed"]))
+    results["records"].append(record)
+    if on_record:
+        on_record(record)
+
+
+def run_all_tests(url: str, api_key: str, verbose: bool = False, parallel: int = 1,
+                  on_record=None) -> dict:
+    """Run all tests and return summary.
+
+    With parallel > 1 the tests run on a bounded thread pool. Each test's output is
+    buffered and replayed in registration order, so results read the same as a
+    sequential run. on_record, if given, is called with each test's result record
+    (see run_test) as soon as it is reported.
+    """
+    results = {"passed": 0, "failed": 0, "details": [], "records": []}
+
+    if parallel <= 1:
+        for name in TEST_FUNCS:
+            _record_result(results, run_test(name, url, api_key, verbose), on_record)
+        return results
+
+    with buffered_stdout() as stdout, \
+            futures.ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="api-test") as pool:
+        pending = [pool.submit(_run_test_buffered, stdout, name, url, api_key, verbose)
+                   for name in TEST_FUNCS]
+        # Replay in registration order; a slow early test holds back later output.
+        for future in pending:
+            record, output = future.result()
+            stdout.write(output)
+            stdout.flush()
+            _record_result(results, record, on_record)
+
+    return results
+
+
+async def run_all_tests_async(url: str, api_key: str, verbose: bool = False,
+                              concurrency: int = 100, on_record=None, client=None) -> dict:
+    """Run all tests on the current event loop and return summary.
+
+    Tests with an ASYNC_TEST_FUNCS variant run as tasks sharing one AsyncHTTPClient;
+    the rest are handed to worker threads. At most `concurrency` tests are in flight
+    at once, and output is replayed in registration order as in run_all_tests.
+    client, if given, is used instead of a new one and left open, so its connections
+    carry over to the next run. The summary also has "connections": the connections
+    opened and requests sent on the client during this run.
+    """
+    results = {"passed": 0, "failed": 0, "details": [], "records": []}
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run_one(stdout: ContextStdout, name: str) -> tuple[dict, str]:
+        async with limit:
+            with stdout.capture() as buffer:
+                if name in ASYNC_TEST_FUNCS:
+                    record = await run_test_async(name, url, api_key, verbose)
+                else:
+                    # asyncio.to_thread copies the context, so the capture follows the test.
+                    record = await asyncio.to_thread(run_test, name, url, api_key, verbose)
+            return record, buffer.getvalue()
+
+    own_client = client is None
+    if own_client:
+        client = AsyncHTTPClient(pool_size=concurrency)
+    opened, sent = client.opened, client.requests
+    try:
+        with buffered_stdout() as stdout, \
+                futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="api-test") as pool:
+            loop.set_default_executor(pool)
+            _ASYNC_CLIENT.set(client)
+            tasks = [asyncio.create_task(run_one(stdout, name)) for name in TEST_FUNCS]
+            for task in tasks:
+                record, output = await task
+                stdout.write(output)
+                stdout.flush()
+                _record_result(results, record, on_record)
+    finally:
+        if own_client:
+            await client.close()
+    results["connections"] = {"opened": client.opened - opened, "requests": client.requests - sent}
+    return results
+
+
+class JsonLinesResultWriter:
+    """Writes one JSON object per test result, flushed as each test finishes.
+
+    A long run can be tailed, and a crashed one leaves every finished result behind.
+    """
+
+    def __init__(self, path: str, run_info: dict | None = None):
+        self.path = path
+        self.run_info = run_info or {}
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(self.run_info | record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JUnitResultWriter:
+    """Writes test results as a JUnit XML report.
+
+    XML cannot be appended to, so the whole (small) report is rewritten after every
+    test and swapped into place; the file on disk is always a complete report.
+    """
+
+    def __init__(self, path: str, run_info: dict | None = None):
+        self.path = path
+        self.run_info = run_info or {}
+        self.records = []
+        self._lock = threading.Lock()
+        self._flush()
+
+    def write(self, record: dict):
+        with self._lock:
+            self.records.append(record)
+            self._flush()
+
+    def _flush(self):
+        suite_name = f"api-test.{self.run_info.get('env', 'test')}"
+        failures = sum(not record["passed"] for record in self.records)
+        suite = ElementTree.Element("testsuite", {
+            "name": suite_name,
+            "tests": str(len(self.records)),
+            "failures": str(failures),
+            "errors": "0",
+            "time": f"{sum(record['duration_ms'] for record in self.records) / 1000:.3f}",
+            "timestamp": self.records[0]["timestamp"] if self.records else datetime.now(timezone.utc).isoformat(),
+        })
+        properties = ElementTree.SubElement(suite, "properties")
+        for key, value in self.run_info.items():
+            ElementTree.SubElement(properties, "property", {"name": key, "value": str(value)})
+        for record in self.records:
+            # --env both tags each record with its environment; keep the two apart.
+            case = ElementTree.SubElement(suite, "testcase", {
+                "classname": f"api-test.{record['env']}" if "env" in record else suite_name,
+                "name": record["name"],
+                "time": f"{record['duration_ms'] / 1000:.3f}",
+            })
+            if not record["passed"]:
+                failure = ElementTree.SubElement(case, "failure", {"message": record["error"]})
+                failure.text = record["error"]
+            ElementTree.SubElement(case, "system-out").text = (
+                f"display_name={record['display_name']} status_code={record['status_code']} "
+                f"latency_ms={record['latency_ms']} response_bytes={record['response_bytes']} "
+                f"requests={record['requests']}"
+            )
+        partial = self.path + ".tmp"
+        ElementTree.ElementTree(suite).write(partial, encoding="utf-8", xml_declaration=True)
+        os.replace(partial, self.path)
+
+    def close(self):
+        pass
+
+
+# Upper bounds (seconds) of the exported latency histogram buckets; chat replies
+# take seconds, so the range reaches well past the usual web defaults.
+METRIC_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _metric_labels(**labels) -> str:
+    """Format a label set, escaping backslashes, quotes and newlines in the values."""
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class TestMetrics:
+    """Cumulative per-test results exported in Prometheus/OpenMetrics text format.
+
+    Pass/fail counts come from the result records passed to observe(); response
+    status counts and latency histograms come from LATENCIES, so they cover every
+    request the tests sent.
+    """
+
+    def __init__(self, env: str):
+        self.env = env
+        self.results = {}
+        self.last = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record: dict):
+        with self._lock:
+            counts = self.results.setdefault(record["name"], {"pass": 0, "fail": 0})
+            counts["pass" if record["passed"] else "fail"] += 1
+            self.last[record["name"]] = (record["passed"], datetime.fromisoformat(record["timestamp"]).timestamp())
+
+    def render(self, openmetrics: bool = True) -> str:
+        """Return the exposition text; openmetrics=False gives the Prometheus 0.0.4 text format."""
+        with self._lock:
+            results = {name: dict(counts) for name, counts in self.results.items()}
+            last = dict(self.last)
+        with _LATENCIES_LOCK:
+            latencies = {key: histogram for key, histogram in LATENCIES.items()}
+            statuses = {key: histogram.total for key, histogram in latencies.items()}
+            by_test = latencies_by_test(latencies)
+
+        lines = []
+
+        def family(name: str, kind: str, help_text: str, unit: str = ""):
+            # OpenMetrics names a counter family without its _total suffix; 0.0.4 with it.
+            exposed = name + "_total" if kind == "counter" and not openmetrics else name
+            lines.append(f"# HELP {exposed} {help_text}")
+            lines.append(f"# TYPE {exposed} {kind}")
+            if unit and openmetrics:
+                lines.append(f"# UNIT {exposed} {unit}")
+
+        family("api_test_results", "counter", "Test runs by result.")
+        for name, counts in results.items():
+            for result, count in counts.items():
+                lines.append(f"api_test_results_total{_metric_labels(env=self.env, test=name, result=result)} {count}")
+        family("api_test_last_passed", "gauge", "1 if the test's latest run passed, else 0.")
+        for name, (passed, _) in last.items():
+            lines.append(f"api_test_last_passed{_metric_labels(env=self.env, test=name)} {int(passed)}")
+        family("api_test_last_run_timestamp_seconds", "gauge", "Start time of the test's latest run.", "seconds")
+        for name, (_, timestamp) in last.items():
+            lines.append(f"api_test_last_run_timestamp_seconds{_metric_labels(env=self.env, test=name)} {timestamp:.3f}")
+        family("api_test_responses", "counter", "Requests sent by tests, by response status (error = no response).")
+        for (name, status), count in sorted(statuses.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            labels = _metric_labels(env=self.env, test=name, status=status if status is not None else "error")
+            lines.append(f"api_test_responses_total{labels} {count}")
+        family("api_test_request_duration_seconds", "histogram", "Latency of requests sent by tests.", "seconds")
+        for name, histogram in by_test.items():
+            for bound, count in zip(METRIC_BUCKETS, histogram.cumulative_counts(METRIC_BUCKETS)):
+                labels = _metric_labels(env=self.env, test=name, le=f"{bound:g}")
+                lines.append(f"api_test_request_duration_seconds_bucket{labels} {count}")
+            labels = _metric_labels(env=self.env, test=name, le="+Inf")
+            lines.append(f"api_test_request_duration_seconds_bucket{labels} {histogram.total}")
+            labels = _metric_labels(env=self.env, test=name)
+            lines.append(f"api_test_request_duration_seconds_count{labels} {histogram.total}")
+            lines.append(f"api_test_request_duration_seconds_sum{labels} {histogram.sum_value / 1_000_000:.6f}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Atomically write the metrics for node_exporter's textfile collector."""
+        partial = path + ".tmp"
+        with open(partial, "w", encoding="utf-8") as file:
+            file.write(self.render(openmetrics=False))
+        os.replace(partial, path)
+
+    def serve(self, host: str, port: int):
+        """Serve /metrics over HTTP from a background thread; returns the server."""
+        import http.server  # Only needed for the endpoint; kept off the startup path.
+
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = metrics.render(openmetrics).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8"
+                                 if openmetrics else "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    env TEXT NOT NULL,
+    url TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    failed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_env_started ON runs (env, started_at);
+CREATE TABLE IF NOT EXISTS test_results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    env TEXT NOT NULL,
+    test TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    status_code INTEGER,
+    latency_ms REAL,
+    duration_ms REAL,
+    response_bytes INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS test_results_env_test_started ON test_results (env, test, started_at);
+CREATE TABLE IF NOT EXISTS latency_histograms (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    env TEXT NOT NULL,
+    test TEXT NOT NULL,
+    status_code INTEGER,
+    started_at TEXT NOT NULL,
+    histogram TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS latency_histograms_env_test_started ON latency_histograms (env, test, started_at);
+"""
+
+
+def save_run_history(db_path: str, env: str, url: str, records: list, latencies: dict) -> int:
+    """Append one run's test result records and latency histograms to the SQLite history.
+
+    Returns the new run id.
+    """
+    started_at = min((record["timestamp"] for record in records), default=datetime.now(timezone.utc).isoformat())
+    with closing(sqlite3.connect(db_path, timeout=30)) as connection, connection:
+        connection.executescript(HISTORY_SCHEMA)
+        run_id = connection.execute(
+            "INSERT INTO runs (started_at, env, url, passed, failed) VALUES (?, ?, ?, ?, ?)",
+            (started_at, env, url, sum(record["passed"] for record in records),
+             sum(not record["passed"] for record in records)),
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO test_results (run_id, env, test, started_at, passed, status_code, latency_ms,"
+            " duration_ms, response_bytes, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, env, record["name"], record["timestamp"], record["passed"], record["status_code"],
+              record["latency_ms"], record["duration_ms"], record["response_bytes"], record["error"])
+             for record in records],
+        )
+        connection.executemany(
+            "INSERT INTO latency_histograms (run_id, env, test, status_code, started_at, histogram)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(run_id, env, name, status, started_at, json.dumps(histogram.to_dict()))
+             for (name, status), histogram in latencies.items()],
+        )
+    return run_id
+
+
+def try_save_run_history(db_path: str, env: str, url: str, records: list, latencies: dict) -> int | None:
+    """save_run_history, printing a one-line error instead of raising when the database cannot be written."""
+    try:
+        return save_run_history(db_path, env, url, records, latencies)
+    except (sqlite3.Error, OSError) as e:
+        print(f"❌ Error: Cannot save the run to {db_path} - {e}")
+        return None
+
+
+def load_history(db_path: str, env: str, runs: int = 20) -> dict:
+    """Summarize the last `runs` runs against env per test.
+
+    Returns {test: {"runs" (distinct runs), "results" (one per execution, so
+    --repeat adds several per run), "passed", "histogram" (all runs merged),
+    "latest" (the newest run's histogram), "last_passed"}}, in first-seen order.
+    """
+    with closing(sqlite3.connect(db_path, timeout=30)) as connection:
+        connection.executescript(HISTORY_SCHEMA)
+        run_ids = [row[0] for row in connection.execute(
+            "SELECT id FROM runs WHERE env = ? ORDER BY started_at DESC, id DESC LIMIT ?", (env, runs))]
+        if not run_ids:
+            return {}
+        placeholders = ",".join("?" * len(run_ids))
+        history = {}
+        for run_id, test, passed in connection.execute(
+                f"SELECT run_id, test, passed FROM test_results WHERE run_id IN ({placeholders})"
+                f" ORDER BY run_id", run_ids):
+            entry = history.setdefault(test, {"runs": 0, "results": 0, "passed": 0, "histogram": LatencyHistogram(),
+                                              "latest": None, "latest_run": None, "last_passed": None,
+                                              "last_run": None})
+            if entry["last_run"] != run_id:
+                entry["last_run"] = run_id
+                entry["runs"] += 1
+            entry["results"] += 1
+            entry["passed"] += passed
+            entry["last_passed"] = bool(passed)
+        for run_id, test, data in connection.execute(
+                f"SELECT run_id, test, histogram FROM latency_histograms WHERE run_id IN ({placeholders})"
+                f" ORDER BY run_id", run_ids):
+            entry = history.get(test)
+            if entry is None:
+                continue
+            histogram = LatencyHistogram.from_dict(json.loads(data))
+            entry["histogram"].merge(histogram)
+            if entry["latest_run"] != run_id:
+                entry["latest_run"], entry["latest"] = run_id, LatencyHistogram()
+            entry["latest"].merge(histogram)
+    return history
+
+
+def print_history(history: dict, env: str, runs: int):
+    """Print rolling pass rate and latency per test from load_history."""
+    print(f"\n{'='*60}")
+    print(f"HISTORY - Environment: {env.upper()} (last {runs} runs)")
+    print(f"{'='*60}")
+    if not history:
+        print("No recorded runs")
+        return
+    order = {name: position for position, name in enumerate(TEST_FUNCS)}
+    print(f"  {'test':<20} {'runs':>5} {'results':>8} {'pass rate':>10} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'last p50':>9} {'last':>6}")
+    for name in sorted(history, key=lambda name: (order.get(name, len(order)), name)):
+        entry = history[name]
+        histogram, latest = entry["histogram"], entry["latest"]
+        last_p50 = f"{latest.percentile(50) * 1000:>9.1f}" if latest else f"{'-':>9}"
+        print(f"  {name:<20} {entry['runs']:>5} {entry['results']:>8} {entry['passed'] / entry['results']:>10.1%} "
+              f"{histogram.percentile(50) * 1000:>9.1f} {histogram.percentile(99) * 1000:>9.1f} "
+              f"{last_p50} {'PASS' if entry['last_passed'] else 'FAIL':>6}")
+
+
+def latencies_by_test(latencies: dict) -> dict:
+    """Merge LATENCIES-style (test, status) histograms into one histogram per test."""
+    merged = {}
+    for (name, _), histogram in latencies.items():
+        merged.setdefault(name, LatencyHistogram()).merge(histogram)
+    return merged
+
+
+def save_baseline(path: str, env: str, latencies: dict):
+    """Save this run's per-test latency histograms as a baseline for --baseline."""
+    baseline = {
+        "env": env,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "tests": {name: histogram.to_dict() for name, histogram in latencies_by_test(latencies).items()},
+    }
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump(baseline, baseline_file)
+
+
+def load_baseline(path: str) -> dict:
+    """Read a baseline saved by save_baseline; returns {test name: LatencyHistogram}."""
+    with open(path, encoding="utf-8") as baseline_file:
+        try:
+            baseline = json.load(baseline_file)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}: {e}") from e
+    if not isinstance(baseline, dict) or not isinstance(baseline.get("tests"), dict):
+        raise ValueError(f"{path}: not a latency baseline (no \"tests\" object); save one with --save-baseline")
+    try:
+        return {name: LatencyHistogram.from_dict(data) for name, data in baseline["tests"].items()}
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{path}: malformed histogram in the baseline ({e!r})") from e
+
+
+def mann_whitney_greater(baseline: LatencyHistogram, current: LatencyHistogram) -> float:
+    """One-sided Mann-Whitney U test p-value that current latencies are larger than baseline's.
+
+    Works on the histograms directly: values sharing a bucket are treated as ties,
+    and the p-value comes from the tie-corrected normal approximation.
+    """
+    n_base, n_current = baseline.total, current.total
+    total = n_base + n_current
+    rank = 0
+    rank_sum = 0.0
+    tie_term = 0
+    for count_base, count_current in zip(baseline.counts, current.counts):
+        tied = count_base + count_current
+        if not tied:
+            continue
+        rank_sum += count_current * (rank + (tied + 1) / 2)
+        rank += tied
+        tie_term += tied ** 3 - tied
+    u_current = rank_sum - n_current * (n_current + 1) / 2
+    mean = n_base * n_current / 2
+    variance = n_base * n_current / 12 * ((total + 1) - tie_term / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u_current - mean - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def holm_adjust(p_values: list) -> list:
+    """Holm-Bonferroni adjusted p-values, in the order given.
+
+    Comparing each adjusted value with alpha keeps the chance of any false
+    positive across all the tests at alpha, instead of alpha per test.
+    """
+    order = sorted(range(len(p_values)), key=lambda position: p_values[position])
+    adjusted = [1.0] * len(p_values)
+    running = 0.0
+    for rank, position in enumerate(order):
+        running = max(running, min(1.0, (len(p_values) - rank) * p_values[position]))
+        adjusted[position] = running
+    return adjusted
+
+
+def compare_to_baseline(baseline: dict, latencies: dict, threshold: float = 0.2, alpha: float = 0.05,
+                        min_samples: int = 5, min_delta: float = 0.005) -> list:
+    """Compare this run's per-test latencies with a baseline read by load_baseline.
+
+    A test regressed when the Mann-Whitney test says its latencies are larger
+    (Holm-adjusted p < alpha across all judged tests) and its p50 or p95 grew both
+    by more than `threshold` (0.2 = 20%) and by more than `min_delta` seconds.
+    Tests with fewer than min_samples requests on either side are reported but not
+    judged; use --repeat to collect enough samples.
+
+    Returns one dict per test in both runs: name, baseline/current sample counts,
+    p50 and p95 of each, p_value (Holm-adjusted; None if not judged) and verdict
+    ("regressed", "ok" or "insufficient samples").
+    """
+    current = latencies_by_test(latencies)
+    comparisons = []
+    grew = {}
+    for name, base in baseline.items():
+        if name not in current:
+            continue
+        now = current[name]
+        comparison = {
+            "name": name,
+            "baseline_n": base.total,
+            "current_n": now.total,
+            "baseline_p50": base.percentile(50),
+            "current_p50": now.percentile(50),
+            "baseline_p95": base.percentile(95),
+            "current_p95": now.percentile(95),
+            "p_value": None,
+            "verdict": "insufficient samples",
+        }
+        if min(base.total, now.total) >= min_samples:
+            comparison["p_value"] = mann_whitney_greater(base, now)
+            grew[name] = any(
+                now.percentile(q) - base.percentile(q) > min_delta
+                and now.percentile(q) > base.percentile(q) * (1 + threshold)
+                for q in (50, 95))
+        comparisons.append(comparison)
+
+    judged = [comparison for comparison in comparisons if comparison["p_value"] is not None]
+    for comparison, adjusted in zip(judged, holm_adjust([comparison["p_value"] for comparison in judged])):
+        comparison["p_value"] = adjusted
+        comparison["verdict"] = "regressed" if adjusted < alpha and grew[comparison["name"]] else "ok"
+    order = {name: position for position, name in enumerate(TEST_FUNCS)}
+    return sorted(comparisons, key=lambda comparison: (order.get(comparison["name"], len(order)), comparison["name"]))
+
+
+def print_baseline_comparison(comparisons: list, path: str):
+    """Print compare_to_baseline results as a table."""
+    print(f"\nBaseline comparison ({path}):")
+    if not comparisons:
+        print("  No tests in common with the baseline")
+        return
+    print(f"  {'test':<20} {'n':>9} {'p50 ms':>17} {'p95 ms':>17} {'p (Holm)':>8}  verdict")
+    for comparison in comparisons:
+        p_value = comparison["p_value"]
+        print(f"  {comparison['name']:<20} "
+              f"{comparison['baseline_n']:>4}/{comparison['current_n']:<4} "
+              f"{comparison['baseline_p50'] * 1000:>7.1f}->{comparison['current_p50'] * 1000:<7.1f} "
+              f"{comparison['baseline_p95'] * 1000:>7.1f}->{comparison['current_p95'] * 1000:<7.1f} "
+              f"{'-' if p_value is None else f'{p_value:.4f}':>8}  {comparison['verdict']}")
+
+
+DEFAULT_HISTORY_DB = "api-test-history.db"
+
+RESULT_WRITERS = {
+    "json": (JsonLinesResultWriter, "api-test-results.jsonl"),
+    "junit": (JUnitResultWriter, "api-test-results.xml"),
+}
+
+
+def open_result_writer(args, run_info: dict):
+    """Create the --output writer (None without --output); exit with an error if its file cannot be written."""
+    if not args.output:
+        return None
+    writer_class, default_path = RESULT_WRITERS[args.output]
+    path = args.output_file or default_path
+    try:
+        return writer_class(path, run_info)
+    except OSError as e:
+        print(f"❌ Error: Cannot write results to {path} - {e}")
+        sys.exit(1)
+
+
+def parse_duration(value: str) -> float:
+    """Parse a duration such as "90", "90s", "5m" or "1h" into seconds."""
+    units = {"s": 1, "m": 60, "h": 3600}
+    text = value.strip().lower()
+    scale = units.get(text[-1:], None)
+    if scale is not None:
+        text = text[:-1]
+    try:
+        seconds = float(text) * (scale or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r} (use e.g. 30, 30s, 5m, 1h)")
+    if seconds < 0:
+        raise argparse.ArgumentTypeError(f"duration must not be negative: {value!r}")
+    return seconds
+
+
+def arrival_schedule(rps: float, duration: float, distribution: str = "constant",
+                     seed: int | None = None):
+    """Yield request start offsets (seconds from start) for an open-loop run.
+
+    "constant" spaces requests exactly 1/rps apart; "poisson" draws exponential
+    gaps with mean 1/rps, modelling independent clients arriving at random. The
+    schedule is fixed up front by `seed` and generated lazily, so a long run does
+    not hold every offset in memory.
+    """
+    rng = random.Random(seed)
+    offset = 0.0
+    while offset < duration:
+        yield offset
+        offset += rng.expovariate(rps) if distribution == "poisson" else 1.0 / rps
+
+
+def _load_request(url: str, api_key: str, intended: float | None = None) -> tuple[float, float, int | None]:
+    """Send one success-payload request.
+
+    Returns (latency, service time, status or None on error). Latency is measured
+    from `intended`, the scheduled start, when given; otherwise it equals the
+    service time measured from the actual send.
+    """
+    started = time.perf_counter()
+    try:
+        status = make_request(url, api_key, success_body()).status_code
+    except requests.exceptions.RequestException:
+        status = None
+    finished = time.perf_counter()
+    return finished - (started if intended is None else intended), finished - started, status
+
+
+def run_open_loop(schedule, send, workers: int, backlog: int | None = None) -> dict:
+    """Call send(intended_start, item) for each (offset, item) in schedule, on time.
+
+    Calls run on `workers` threads and are dispatched at their scheduled time
+    whether or not earlier ones have finished. When every worker is busy a request
+    waits in the pool's queue, and because send receives the intended start time,
+    that wait counts towards its latency instead of silently thinning the load
+    (coordinated omission).
+
+    At most `backlog` calls (default 10 per worker) wait for a worker. A call due
+    while the backlog is full is dropped and counted, so a backend that falls
+    behind cannot grow the queue without limit. An exception raised by send stops
+    the schedule, cancels the calls still waiting and is re-raised. Returns
+    {"sent", "dropped"}.
+    """
+    slots = threading.BoundedSemaphore(workers + (10 * workers if backlog is None else backlog))
+    failures = []
+    counts = {"sent": 0, "dropped": 0}
+
+    def done(future):
+        slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            failures.append(future.exception())
+
+    with futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-load") as pool:
+        started = time.perf_counter()
+        for offset, item in schedule:
+            intended = started + offset
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if failures:
+                pool.shutdown(cancel_futures=True)
+                break
+            if not slots.acquire(blocking=False):
+                counts["dropped"] += 1
+                continue
+            counts["sent"] += 1
+            pool.submit(send, intended, item).add_done_callback(done)
+    if failures:
+        raise failures[0]
+    return counts
+
+
+def run_load(url: str, api_key: str, duration: float, users: int = 10,
+             rps: float | None = None, arrival: str = "constant", seed: int | None = None) -> dict:
+    """Drive the success request for `duration` seconds and return a load report.
+
+    Without rps this is closed-loop: `users` virtual users each send their next
+    request as soon as the previous one returns. With rps it is open-loop: requests
+    follow a precomputed `arrival` schedule (see arrival_schedule) on a pool of
+    `users` workers, and latency is measured from each request's scheduled start.
+    An unexpected exception in a virtual user or worker is re-raised after the run.
+    """
+    latency = LatencyHistogram()
+    service_time = LatencyHistogram()
+    status_counts = {}
+    samples_lock = threading.Lock()
+
+    def send(intended: float | None = None, _item=None):
+        sample_latency, sample_service, status = _load_request(url, api_key, intended)
+        with samples_lock:
+            latency.record(sample_latency)
+            service_time.record(sample_service)
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    dropped = 0
+    started = time.perf_counter()
+    if rps is None:
+        deadline = started + duration
+
+        def virtual_user():
+            while time.perf_counter() < deadline:
+                send()
+
+        with futures.ThreadPoolExecutor(max_workers=users, thread_name_prefix="api-load") as pool:
+            running = [pool.submit(virtual_user) for _ in range(users)]
+        # An exception that ended a virtual user early would otherwise only show up as less load.
+        for user in running:
+            user.result()
+    else:
+        schedule = ((offset, None) for offset in arrival_schedule(rps, duration, arrival, seed))
+        dropped = run_open_loop(schedule, send, users)["dropped"]
+
+    elapsed = time.perf_counter() - started
+    completed = latency.total
+    if dropped:
+        # A dropped arrival never got an answer. Count it as an error, and as a
+        # request that took the whole run, so the percentiles are not taken from
+        # only the requests that got through (coordinated omission again).
+        latency.record(elapsed, dropped)
+    errors = sum(count for status, count in status_counts.items() if status != 200) + dropped
+
+    return {
+        "mode": f"open-loop, {arrival} arrivals" if rps is not None else "closed-loop",
+        "users": users,
+        "target_rps": rps,
+        "elapsed": elapsed,
+        "requests": latency.total,
+        "errors": errors,
+        "dropped": dropped,
+        "status_counts": status_counts,
+        "throughput": completed / elapsed if elapsed else 0.0,
+        "error_rate": errors / latency.total if latency.total else 0.0,
+        "latency": latency.summary(),
+        "service_time": service_time.summary(),
+    }
+
+
+def find_capacity(url: str, api_key: str, slo_p99: float, slo_error_rate: float,
+                  step_duration: float = 10.0, max_users: int = 256, on_step=None) -> dict:
+    """Search for the highest closed-loop concurrency that still meets the SLO.
+
+    Concurrency doubles from 1 until a step breaches the SLO (p99 latency above
+    slo_p99 seconds or error rate above slo_error_rate) or reaches max_users, then
+    a binary search narrows the gap between the last passing and the first failing
+    level to within 10%. Each step is a run_load of step_duration seconds;
+    on_step(report, passed) is called after each one.
+
+    Returns {"steps": [(report, passed), ...], "capacity": report or None,
+    "peak": report or None}: capacity is the passing step with the most users, the
+    highest concurrency the backend sustained; peak is the passing step with the
+    highest throughput, which can be a lower level when throughput plateaus.
+    """
+    steps = []
+
+    def measure(users: int) -> bool:
+        report = run_load(url, api_key, step_duration, users)
+        passed = report["latency"][99] <= slo_p99 and report["error_rate"] <= slo_error_rate
+        steps.append((report, passed))
+        if on_step:
+            on_step(report, passed)
+        return passed
+
+    good, bad = 0, None
+    users = 1
+    while bad is None and good < max_users:
+        if measure(users):
+            good = users
+            users = min(users * 2, max_users)
+        else:
+            bad = users
+
+    while bad is not None and bad - good > max(1, good // 10):
+        users = (good + bad) // 2
+        if measure(users):
+            good = users
+        else:
+            bad = users
+
+    passing = [report for report, passed in steps if passed]
+    return {"steps": steps,
+            "capacity": max(passing, key=lambda report: report["users"], default=None),
+            "peak": max(passing, key=lambda report: report["throughput"], default=None)}
+
+
+def print_capacity_step(report: dict, passed: bool):
+    """Print one find_capacity step as it completes."""
+    print(f"  {report['users']:>5} users  {report['throughput']:>8.1f} req/s  "
+          f"p99={report['latency'][99] * 1000:>8.1f}ms  errors={report['error_rate']:>6.2%}  "
+          f"{'OK' if passed else 'SLO BREACH'}")
+
+
+def _capture_timestamp(value) -> float | None:
+    """Convert a capture timestamp (epoch seconds/milliseconds or ISO 8601) to epoch seconds."""
+    if isinstance(value, (int, float)):
+        # Epoch milliseconds are common in gateway logs.
+        return value / 1000 if value > 1e11 else float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def read_capture(path: str, stats: dict | None = None):
+    """Yield replayable records from a JSON Lines traffic capture, one line at a time.
+
+    Each line is an object with the request in "payload" (a JSON value) or "body" (a
+    raw string), yielded encoded to bytes in "body" so nothing is serialized on the
+    send path, and optionally "timestamp" (epoch
+    seconds/milliseconds or ISO 8601), "status" (the recorded status code) and
+    "headers" (overrides merged into the request headers). Lines that are not valid
+    JSON or carry no request are counted in stats["skipped"] and otherwise ignored.
+    """
+    if stats is not None:
+        stats.setdefault("skipped", 0)
+    with open(path, encoding="utf-8") as capture:
+        for line in capture:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            if not isinstance(record, dict) or ("payload" not in record and "body" not in record):
+                if stats is not None:
+                    stats["skipped"] += 1
+                continue
+            raw = record.get("body")
+            yield {
+                "timestamp": _capture_timestamp(record.get("timestamp", record.get("ts"))),
+                "body": (str(raw).encode("utf-8") if raw is not None and record.get("payload") is None
+                         else json_dumps(record.get("payload"))),
+                "status": record.get("status", record.get("status_code")),
+                "headers": record.get("headers") or None,
+            }
+
+
+def replay_schedule(records, speed: float = 1.0):
+    """Yield (offset, record) pairs keeping the recorded gaps between requests, divided by speed.
+
+    Records without a timestamp are sent straight after the previous one.
+    """
+    first = None
+    offset = 0.0
+    for record in records:
+        if record["timestamp"] is not None:
+            if first is None:
+                first = record["timestamp"]
+            offset = max((record["timestamp"] - first) / speed, offset)
+        yield offset, record
+
+
+def _replay_request(url: str, api_key: str, record: dict, intended: float) -> tuple[float, float, int | None]:
+    """Send one captured request; return (latency from intended start, service time, status)."""
+    started = time.perf_counter()
+    try:
+        status = make_request(url, api_key, record["body"], record["headers"]).status_code
+    except requests.exceptions.RequestException:
+        status = None
+    finished = time.perf_counter()
+    return finished - intended, finished - started, status
+
+
+def run_replay(url: str, api_key: str, path: str, speed: float = 1.0, workers: int = 10) -> dict:
+    """Replay a traffic capture (see read_capture) against url and return a replay report.
+
+    Requests keep their recorded inter-arrival times, scaled by speed, and are sent
+    open-loop on `workers` threads; each response status is checked against the
+    recorded one where the capture has it.
+    """
+    latency = LatencyHistogram()
+    service_time = LatencyHistogram()
+    status_counts = {}
+    mismatches = {}
+    counts = {"skipped": 0, "checked": 0}
+    samples_lock = threading.Lock()
+
+    def send(intended: float, record: dict):
+        sample_latency, sample_service, status = _replay_request(url, api_key, record, intended)
+        with samples_lock:
+            latency.record(sample_latency)
+            service_time.record(sample_service)
+            status_counts[status] = status_counts.get(status, 0) + 1
+            if record["status"] is not None:
+                counts["checked"] += 1
+                if status != record["status"]:
+                    key = (record["status"], status)
+                    mismatches[key] = mismatches.get(key, 0) + 1
+
+    started = time.perf_counter()
+    dropped = run_open_loop(replay_schedule(read_capture(path, counts), speed), send, workers)["dropped"]
+    elapsed = time.perf_counter() - started
+    completed = latency.total
+    if dropped:
+        # As in run_load: a dropped request counts as one that took the whole run.
+        latency.record(elapsed, dropped)
+
+    return {
+        "path": path,
+        "speed": speed,
+        "elapsed": elapsed,
+        "requests": latency.total,
+        "skipped": counts["skipped"],
+        "dropped": dropped,
+        "checked": counts["checked"],
+        "mismatches": mismatches,
+        "status_counts": status_counts,
+        "throughput": completed / elapsed if elapsed else 0.0,
+        "latency": latency.summary(),
+        "service_time": service_time.summary(),
+    }
+
+
+def print_replay_report(report: dict):
+    """Print a run_replay report."""
+    print(f"\n{'='*60}")
+    print(f"REPLAY SUMMARY ({report['path']} at {report['speed']:g}x)")
+    print(f"{'='*60}")
+    print(f"Duration:    {report['elapsed']:.1f}s")
+    print(f"Requests:    {report['requests']} ({report['skipped']} capture lines skipped)")
+    if report["dropped"]:
+        print(f"Dropped:     {report['dropped']} requests (backlog full; the client fell behind)")
+    print(f"Throughput:  {report['throughput']:.1f} req/s")
+    statuses = ", ".join(f"{'error' if status is None else status}: {count}"
+                         for status, count in sorted(report["status_counts"].items(), key=str))
+    print(f"Statuses:    {statuses or 'none'}")
+    mismatched = sum(report["mismatches"].values())
+    print(f"Status check: {report['checked'] - mismatched}/{report['checked']} matched the capture")
+    for (expected, got), count in sorted(report["mismatches"].items(), key=str):
+        print(f"  - expected {expected}, got {'error' if got is None else got}: {count}")
+    print(f"Latency:     {_format_latency(report['latency'])}")
+    print(f"Service:     {_format_latency(report['service_time'])}")
+    print_dropped_warning(report)
+
+
+def parse_size(value: str) -> int:
+    """Parse a byte count like "4096", "512K", "16M" or "1G" (binary units)."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*", value, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r} (use e.g. 4096, 512K or 16M)")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmg".index(unit.lower() or " "))
+
+
+def _format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def sweep_payload(kind: str, step: int) -> dict:
+    """Build a success-schema payload of about `step` bytes ("bytes") or with `step` messages ("messages")."""
+    prompt = SUCCESS_PAYLOAD["messages"][-1]
+    payload = {"threadId": "payload-sweep", "messages": [dict(prompt)]}
+    if kind == "bytes":
+        padding = step - len(json_dumps(payload))
+        if padding > 0:
+            payload["messages"][0]["content"] += " " + "x" * (padding - 1)
+    else:
+        # Earlier turns alternate user and assistant, as a real history does.
+        history = [{"role": "user" if position % 2 == 0 else "assistant", "content": f"Message {position + 1}."}
+                   for position in range(step - 1)]
+        if history and history[-1]["role"] == "user":
+            history[-1]["role"] = "assistant"
+        payload["messages"] = history + payload["messages"]
+    return payload
+
+
+def run_payload_sweep(url: str, api_key: str, max_bytes: int, max_messages: int, samples: int = 3,
+                      on_step=None) -> dict:
+    """Send success-schema payloads on geometric ladders of size and message count.
+
+    The size ladder doubles from 1 KB to max_bytes, the message ladder from 1 to
+    max_messages. Each step sends `samples` requests and keeps the median
+    serialization, upload, server wait (time to first byte) and total time; the
+    session must have phase timing on. A ladder stops at its first step the backend
+    rejects (or drops), which is where its limit is. on_step, if given, is called
+    with each step's result. Returns {"bytes": [...], "messages": [...]}.
+    """
+    headers = json_headers(api_key)
+    ladders = {
+        "bytes": [1024 << shift for shift in range(max(max_bytes // 1024, 1).bit_length())],
+        "messages": [1 << shift for shift in range(max(max_messages, 1).bit_length())],
+    }
+    report = {}
+    for kind, steps in ladders.items():
+        report[kind] = []
+        for step in steps:
+            payload = sweep_payload(kind, step)
+            timings = {"serialize": [], "upload": [], "server": [], "total": []}
+            statuses = []
+            for _ in range(samples):
+                started = time.perf_counter()
+                body = json_dumps(payload)
+                timings["serialize"].append(time.perf_counter() - started)
+                with collect_requests() as sent:
+                    try:
+                        send_request("POST", url, data=body, headers=headers, timeout=120)
+                    except requests.exceptions.RequestException:
+                        pass
+                request = sent[-1]
+                statuses.append(request["status_code"])
+                phases = request["phases"] or {}
+                timings["upload"].append(phases.get("upload"))
+                timings["server"].append(phases.get("ttfb"))
+                timings["total"].append(request["latency"])
+            result = {
+                "kind": kind,
+                "step": step,
+                "bytes": len(body),
+                "messages": len(payload["messages"]),
+                "statuses": statuses,
+                **{name: _median(values) for name, values in timings.items()},
+            }
+            report[kind].append(result)
+            if on_step:
+                on_step(result)
+            if any(status != 200 for status in statuses):
+                break
+    return report
+
+
+def print_sweep_step(result: dict):
+    """Print one run_payload_sweep step as a table row."""
+    def ms(seconds):
+        return f"{seconds * 1000:>9.1f}" if seconds is not None else f"{'-':>9}"
+
+    statuses = ",".join(sorted({"error" if status is None else str(status) for status in result["statuses"]}))
+    print(f"  {result['kind']:<8} {result['step']:>8} {_format_size(result['bytes']):>9} "
+          f"{ms(result['serialize'])} {ms(result['upload'])} {ms(result['server'])} {ms(result['total'])}"
+          f"   {statuses}")
+    sys.stdout.flush()
+
+
+def print_sweep_report(report: dict):
+    """Print where each payload ladder stopped being accepted."""
+    print(f"\n{'='*60}")
+    print("PAYLOAD SWEEP SUMMARY")
+    print(f"{'='*60}")
+    for kind, label in (("bytes", "Size"), ("messages", "Messages")):
+        steps = report[kind]
+        accepted = [result for result in steps if all(status == 200 for status in result["statuses"])]
+        largest = (f"{_format_size(accepted[-1]['bytes'])} / {accepted[-1]['messages']} messages"
+                   if accepted else "none")
+        print(f"{label + ':':<10} largest accepted {largest}", end="")
+        if len(accepted) < len(steps):
+            rejected = steps[-1]
+            statuses = ",".join(sorted({"error" if status is None else str(status)
+                                        for status in rejected["statuses"] if status != 200}))
+            print(f"; first rejected {_format_size(rejected['bytes'])} / {rejected['messages']} "
+                  f"messages ({statuses})")
+        else:
+            print("; no limit reached")
+
+
+def _slope(points: list) -> float | None:
+    """Least-squares slope of y over x for [(x, y), ...], or None with under two x values."""
+    if len({x for x, _ in points}) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return covariance / variance
+
+
+def run_conversations(url: str, api_key: str, conversations: int, turns: int) -> dict:
+    """Hold `conversations` threads open at once, each sending `turns` turns with its growing history.
+
+    Every conversation has its own threadId. Each turn appends a user message,
+    sends the whole history and appends the assistant's reply, so turn k carries
+    2k - 1 messages. A conversation stops at its first failed turn, since later turns
+    would not carry a real history. Returns per-turn latency, request and response
+    sizes, plus how latency grows per turn.
+    """
+    prefix = f"bench-{random.getrandbits(32):08x}"
+    stats = [{"latency": LatencyHistogram(), "errors": 0, "history": 2 * turn + 1,
+              "request_bytes": 0, "response_bytes": 0} for turn in range(turns)]
+    samples = []
+    lock = threading.Lock()
+
+    def converse(index: int):
+        messages = []
+        for turn in range(turns):
+            messages.append({"role": "user", "content": f"Turn {turn + 1}: reply with one short sentence."})
+            body = json_dumps({"threadId": f"{prefix}-{index:04d}", "messages": messages})
+            started = time.perf_counter()
+            try:
+                response = send_request("POST", url, data=body, timeout=30, headers=json_headers(api_key))
+                reply = (reply_fields(response.content) or {}).get("content") if response.status_code == 200 else None
+            except requests.exceptions.RequestException:
+                response, reply = None, None
+            elapsed = time.perf_counter() - started
+            with lock:
+                turn_stats = stats[turn]
+                if reply is None:
+                    turn_stats["errors"] += 1
+                    return
+                turn_stats["latency"].record(elapsed)
+                turn_stats["request_bytes"] += len(body)
+                turn_stats["response_bytes"] += len(response.content)
+                samples.append((turn + 1, elapsed))
+            messages.append({"role": "assistant", "content": reply})
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=conversations, thread_name_prefix="api-conversation") as pool:
+        list(pool.map(converse, range(conversations)))
+    elapsed = time.perf_counter() - started
+
+    per_turn = []
+    for turn, turn_stats in enumerate(stats, start=1):
+        count = turn_stats["latency"].total
+        per_turn.append({
+            "turn": turn,
+            "history": turn_stats["history"],
+            "requests": count + turn_stats["errors"],
+            "errors": turn_stats["errors"],
+            "request_bytes": turn_stats["request_bytes"] / count if count else None,
+            "response_bytes": turn_stats["response_bytes"] / count if count else None,
+            "latency": turn_stats["latency"].summary() if count else None,
+        })
+    return {
+        "conversations": conversations,
+        "turns": turns,
+        "elapsed": elapsed,
+        "errors": sum(turn_stats["errors"] for turn_stats in stats),
+        "per_turn": per_turn,
+        "seconds_per_turn": _slope(samples),
+    }
+
+
+def print_conversation_report(report: dict):
+    """Print a run_conversations report."""
+    print(f"\n{'='*60}")
+    print(f"CONVERSATION SUMMARY ({report['conversations']} threads x {report['turns']} turns)")
+    print(f"{'='*60}")
+    print(f"  {'turn':>4} {'msgs':>5} {'ok':>5} {'err':>4} {'req KB':>8} {'resp B':>8} "
+          f"{'p50 ms':>9} {'p99 ms':>9}")
+    for turn in report["per_turn"]:
+        latency = turn["latency"]
+        sizes = (f"{turn['request_bytes'] / 1024:>8.1f} {turn['response_bytes']:>8.0f}"
+                 if latency else f"{'-':>8} {'-':>8}")
+        timings = f"{latency[50] * 1000:>9.1f} {latency[99] * 1000:>9.1f}" if latency else f"{'-':>9} {'-':>9}"
+        print(f"  {turn['turn']:>4} {turn['history']:>5} {turn['requests'] - turn['errors']:>5} "
+              f"{turn['errors']:>4} {sizes} {timings}")
+    print(f"\nDuration:    {report['elapsed']:.1f}s")
+    print(f"Errors:      {report['errors']}")
+    if report["seconds_per_turn"] is not None:
+        # Each turn adds a user message and a reply, so this is also the cost of two more messages.
+        print(f"Growth:      {report['seconds_per_turn'] * 1000:+.1f}ms latency per turn (least squares)")
+
+
+# Requests the cold-start probe sends after each idle gap: (payload, expected status).
+# The 400 is rejected by the function itself rather than the gateway, so it still
+# pays for a cold start while costing no LLM tokens.
+COLD_START_REQUESTS = {
+    "success": (SUCCESS_PAYLOAD, 200),
+    "bad-request": ({"messages": [{"role": "user", "content": "Hello"}]}, 400),
+}
+
+
+def parse_durations(value: str) -> list:
+    """Parse a comma-separated list of durations, e.g. "0,1m,5m"."""
+    return [parse_duration(part) for part in value.split(",") if part.strip()]
+
+
+def cold_threshold(values: list, min_ratio: float = 2.0) -> float | None:
+    """Split latencies into warm and cold, returning the lowest cold latency or None.
+
+    Picks the split of the sorted log-latencies with the largest between-group
+    variance (Otsu's method), and only accepts it when the slower group's median is
+    at least min_ratio times the faster group's; otherwise every sample is warm.
+    """
+    values = sorted(value for value in values if value and value > 0)
+    if len(values) < 2:
+        return None
+    logs = [math.log(value) for value in values]
+    total = sum(logs)
+    best, best_split, running = -1.0, None, 0.0
+    for split in range(1, len(logs)):
+        running += logs[split - 1]
+        low_mean = running / split
+        high_mean = (total - running) / (len(logs) - split)
+        score = split * (len(logs) - split) * (high_mean - low_mean) ** 2
+        if score > best:
+            best, best_split = score, split
+    if _median(values[best_split:]) < min_ratio * _median(values[:best_split]):
+        return None
+    return values[best_split]
+
+
+def _cold_start_request(url: str, api_key: str, kind: str) -> dict:
+    payload, expected = COLD_START_REQUESTS[kind]
+    with collect_requests() as sent:
+        try:
+            send_request("POST", url, data=json_dumps(payload), headers=json_headers(api_key), timeout=60)
+        except requests.exceptions.RequestException:
+            pass
+    request = sent[-1]
+    phases = request["phases"] or {}
+    return {
+        "kind": kind,
+        "status_code": request["status_code"],
+        "ok": request["status_code"] == expected,
+        "latency": request["latency"],
+        # Server wait excludes reconnecting after the idle gap, which is not a cold start.
+        "server": phases.get("ttfb", request["latency"]),
+    }
+
+
+def run_cold_start(url: str, api_key: str, gaps: list, probes: int = 3, min_ratio: float = 2.0,
+                   on_probe=None) -> dict:
+    """Idle for each gap, then fire every COLD_START_REQUESTS kind at once, `probes` times per gap.
+
+    Right after each idle probe the same requests are sent again back to back as a
+    warm reference. Samples are classified per kind with cold_threshold on their
+    server wait (time to first byte), so the session must have phase timing on.
+    on_probe, if given, is called with (gap, samples) after each probe.
+    """
+    samples = []
+    kinds = list(COLD_START_REQUESTS)
+    with futures.ThreadPoolExecutor(max_workers=len(kinds), thread_name_prefix="api-cold-start") as pool:
+        for gap in gaps:
+            for _ in range(probes):
+                time.sleep(gap)
+                probe = []
+                for after_idle in (True, False):
+                    for sample in pool.map(lambda kind: _cold_start_request(url, api_key, kind), kinds):
+                        probe.append(sample | {"gap": gap, "after_idle": after_idle})
+                samples += probe
+                if on_probe:
+                    on_probe(gap, probe)
+
+    report = {"gaps": gaps, "probes": probes, "kinds": {}}
+    for kind in kinds:
+        kind_samples = [sample for sample in samples if sample["kind"] == kind and sample["ok"]]
+        threshold = cold_threshold([sample["server"] for sample in kind_samples], min_ratio)
+        for sample in kind_samples:
+            sample["cold"] = threshold is not None and sample["server"] >= threshold
+        cold = [sample["server"] for sample in kind_samples if sample["cold"]]
+        warm = [sample["server"] for sample in kind_samples if not sample["cold"]]
+        by_gap = {}
+        for gap in gaps:
+            idle = [sample for sample in kind_samples if sample["gap"] == gap and sample["after_idle"]]
+            by_gap[gap] = (sum(sample["cold"] for sample in idle), len(idle))
+        report["kinds"][kind] = {
+            "samples": len(kind_samples),
+            "errors": sum(sample["kind"] == kind and not sample["ok"] for sample in samples),
+            "threshold": threshold,
+            "cold": len(cold),
+            "warm_p50": _median(warm),
+            "cold_p50": _median(cold),
+            "by_gap": by_gap,
+            "reference_cold": sum(sample["cold"] for sample in kind_samples if not sample["after_idle"]),
+        }
+    return report
+
+
+def print_cold_start_probe(gap: float, probe: list):
+    """Print one cold-start probe: server wait after the idle gap and back to back."""
+    cells = []
+    for sample in probe:
+        if sample["after_idle"]:
+            reference = next(other for other in probe if other["kind"] == sample["kind"] and not other["after_idle"])
+            status = "" if sample["ok"] else f" ({sample['status_code'] or 'error'}!)"
+            cells.append(f"{sample['kind']} {sample['server'] * 1000:.0f}ms vs {reference['server'] * 1000:.0f}ms"
+                         f"{status}")
+    print(f"  after {gap:>5g}s idle: " + ", ".join(cells))
+    sys.stdout.flush()
+
+
+def print_cold_start_report(report: dict):
+    """Print cold-start frequency and penalty per request kind and idle gap."""
+    print(f"\n{'='*60}")
+    print("COLD START SUMMARY (server wait, i.e. time to first byte)")
+    print(f"{'='*60}")
+    for kind, result in report["kinds"].items():
+        print(f"\n{kind}: {result['samples']} samples, {result['errors']} unexpected responses")
+        if result["warm_p50"] is not None:
+            print(f"  Warm p50:     {result['warm_p50'] * 1000:.1f}ms")
+        if not result["cold"]:
+            print("  Cold starts:  none detected (latencies form a single group)")
+            continue
+        print(f"  Cold p50:     {result['cold_p50'] * 1000:.1f}ms (threshold {result['threshold'] * 1000:.1f}ms)")
+        print(f"  Penalty:      +{(result['cold_p50'] - result['warm_p50']) * 1000:.1f}ms "
+              f"({result['cold_p50'] / result['warm_p50']:.1f}x warm)")
+        for gap, (cold, total) in result["by_gap"].items():
+            print(f"  After {gap:>5g}s:  {cold}/{total} cold ({cold / total:.0%})" if total else
+                  f"  After {gap:>5g}s:  no samples")
+        if result["reference_cold"]:
+            print(f"  Note: {result['reference_cold']} back-to-back reference sample(s) also looked cold")
+
+
+def run_encoding_benchmark(iterations: int = 20000, rounds: int = 5) -> dict:
+    """Measure the client CPU spent building each request's body and headers.
+
+    For a short and a long payload, compares letting requests encode `json=` with a
+    new headers dict per call against a body encoded once with frozen headers, and
+    times the encoders on their own. Requests are prepared but never sent. The
+    variants take turns over `rounds` rounds and keep their fastest round, which
+    filters out noise from other processes. Returns
+    {payload label: [(variant, microseconds per request)]}.
+    """
+    session = requests.Session()
+    url = "http://localhost/chat"
+    history = {"threadId": "encoding-benchmark", "messages": [
+        {"role": "user" if position % 2 == 0 else "assistant", "content": f"Message {position}: " + "lorem ipsum " * 20}
+        for position in range(50)
+    ]}
+
+    def json_request(payload):
+        return lambda: session.prepare_request(requests.Request(
+            "POST", url, headers={"Content-Type": "application/json", "X-Api-Key": "benchmark-key"}, json=payload))
+
+    def encoded_request(body, headers):
+        return lambda: session.prepare_request(requests.Request("POST", url, headers=headers, data=body))
+
+    variants = []
+    for label, payload in (("success payload", SUCCESS_PAYLOAD), ("50-message history", history)):
+        variants.append((label, "json= with new headers dict", json_request(payload)))
+        variants.append((label, "encoded body, frozen headers",
+                         encoded_request(json_dumps(payload), json_headers("benchmark-key"))))
+        for name in ("json", "orjson"):
+            try:
+                dumps = json_codec(name)[0]
+            except ImportError:
+                continue
+            variants.append((label, f"encode only: {name}", functools.partial(dumps, payload)))
+
+    per_round = max(iterations // rounds, 1)
+    best = [math.inf] * len(variants)
+    for _ in range(rounds):
+        for position, (_, _, func) in enumerate(variants):
+            started = time.process_time()
+            for _ in range(per_round):
+                func()
+            best[position] = min(best[position], (time.process_time() - started) / per_round * 1_000_000)
+
+    results = {}
+    for (label, variant, _), micros in zip(variants, best):
+        results.setdefault(label, []).append((variant, micros))
+    return results
+
+
+def print_encoding_benchmark(results: dict, iterations: int):
+    """Print run_encoding_benchmark results, with the saving of the encoded-once path."""
+    print(f"\nClient CPU per request (µs, {iterations} iterations, JSON codec: {JSON_CODEC}):")
+    for label, rows in results.items():
+        print(f"  {label}")
+        (reference_variant, reference), (encoded_variant, encoded), *encoders = rows
+        print(f"    {reference_variant:<32} {reference:>8.1f}")
+        print(f"    {encoded_variant:<32} {encoded:>8.1f}  ({encoded - reference:+.1f}µs, "
+              f"{(encoded - reference) / reference:+.0%})")
+        for variant, micros in encoders:
+            print(f"    {variant:<32} {micros:>8.1f}")
+
+
+def _format_latency(summary: dict) -> str:
+    """Render a {50: s, ..., 99.9: s, "max": s} summary as "p50=..ms  ...  max=..ms"."""
+    return "  ".join(
+        f"{'max' if key == 'max' else f'p{key:g}'}={value * 1000:.1f}ms" for key, value in summary.items()
+    )
+
+
+def print_phase_table(phase_latencies: dict):
+    """Print the median of each request phase per test, from PHASE_LATENCIES-style histograms."""
+    if not phase_latencies:
+        return
+    order = {name: position for position, name in enumerate(TEST_FUNCS)}
+    names = sorted({name for name, _ in phase_latencies}, key=lambda name: (order.get(name, len(order)), name))
+    totals = {}
+    print("\nRequest phases (p50 ms; - where the connection was reused):")
+    print(f"  {'test':<20} " + " ".join(f"{phase:>8}" for phase in PHASES))
+    for name in names + ["all"]:
+        cells = []
+        for phase in PHASES:
+            if name == "all":
+                histogram = totals.get(phase)
+            else:
+                histogram = phase_latencies.get((name, phase))
+                if histogram is not None:
+                    totals.setdefault(phase, LatencyHistogram()).merge(histogram)
+            cells.append(f"{histogram.percentile(50) * 1000:>8.1f}" if histogram else f"{'-':>8}")
+        print(f"  {name:<20} " + " ".join(cells))
+
+
+def print_stream_table(stream_latencies: dict):
+    """Print time-to-first-byte/token and token rate per test, from STREAM_LATENCIES-style histograms."""
+    if not stream_latencies:
+        return
+    order = {name: position for position, name in enumerate(TEST_FUNCS)}
+    names = sorted({name for name, _ in stream_latencies}, key=lambda name: (order.get(name, len(order)), name))
+    print("\nStreaming:")
+    for name in names:
+        parts = []
+        for metric, label in (("ttfb", "TTFB"), ("ttft", "TTFT")):
+            histogram = stream_latencies.get((name, metric))
+            if histogram is not None:
+                parts.append(f"{label} p50={histogram.percentile(50) * 1000:.1f}ms "
+                             f"p99={histogram.percentile(99) * 1000:.1f}ms")
+        tpot = stream_latencies.get((name, "tpot"))
+        if tpot is not None and tpot.mean:
+            parts.append(f"{1.0 / tpot.mean:.1f} tokens/s")
+        print(f"  {name:<20} " + ", ".join(parts))
+
+
+def print_load_report(report: dict):
+    """Print a run_load report."""
+    print(f"\n{'='*60}")
+    print(f"LOAD SUMMARY ({report['mode']})")
+    print(f"{'='*60}")
+    if report["target_rps"] is not None:
+        print(f"Target rate: {report['target_rps']:.1f} req/s on {report['users']} workers")
+    else:
+        print(f"Virtual users: {report['users']}")
+    print(f"Duration:    {report['elapsed']:.1f}s")
+    print(f"Requests:    {report['requests']}")
+    if report["target_rps"] is not None:
+        print(f"Throughput:  {report['throughput']:.1f} req/s answered of {report['target_rps']:.1f} scheduled")
+    else:
+        print(f"Throughput:  {report['throughput']:.1f} req/s")
+    print(f"Error rate:  {report['error_rate']:.2%} ({report['errors']} errors)")
+    if report["dropped"]:
+        print(f"Dropped:     {report['dropped']} scheduled requests (backlog full; the client fell behind)")
+    statuses = ", ".join(f"{'error' if status is None else status}: {count}"
+                         for status, count in sorted(report["status_counts"].items(), key=str))
+    print(f"Statuses:    {statuses or 'none'}")
+    print(f"Latency:     {_format_latency(report['latency'])}")
+    if report["target_rps"] is not None:
+        # Service time excludes queueing behind busy workers; a gap to latency means the
+        # client could not keep up with the schedule.
+        print(f"Service:     {_format_latency(report['service_time'])}")
+    print_dropped_warning(report)
+
+
+def print_dropped_warning(report: dict):
+    """Warn under a load or replay report that dropped requests skew its numbers."""
+    if report["dropped"]:
+        print(f"\n⚠️  {report['dropped']} of {report['requests']} scheduled requests "
+              f"({report['dropped'] / report['requests']:.1%}) were dropped.")
+        print(f"   They count as {report['elapsed']:.1f}s in the latency percentiles, "
+              "which are not the backend's latency.")
+
+
+def print_latency_table(latencies: dict):
+    """Print per-test, per-status latency percentiles from LATENCIES-style histograms."""
+    order = {name: position for position, name in enumerate(TEST_FUNCS)}
+    keys = sorted(latencies, key=lambda key: (order.get(key[0], len(order)), key[0], str(key[1])))
+    if not keys:
+        return
+    print("\nLatency (ms):")
+    print(f"  {'test':<20} {'status':>6} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'p99.9':>8} {'max':>8}")
+    for name, status in keys:
+        histogram = latencies[(name, status)]
+        summary = histogram.summary()
+        values = " ".join(f"{value * 1000:>8.1f}" for value in summary.values())
+        print(f"  {name:<20} {'error' if status is None else status:>6} {histogram.total:>6} {values}")
+
+
+def parse_args(table_error: Exception | None = None):
+    """Parse command line arguments.
+
+    table_error is why the test case table failed to load, if it did; --help still
+    works, and anything else reports it as a usage error.
+    """
+    parser = argparse.ArgumentParser(
+        description="Test API endpoints for success and failure scenarios.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+    python test_api.py --env test
+    python test_api.py --env prod --verbose
+    python test_api.py --env test --test success
+        """,
+    )
+    parser.add_argument(
+        "--env",
+        choices=["prod", "test", "both"],
+        default="test",
+        help="Environment to test; both runs prod and test side by side (default: test)",
+    )
+    parser.add_argument(
+        "--verbose", "-v",
+        action="store_true",
+        help="Show detailed request/response information",
+    )
+    parser.add_argument(
+        "--test", "-t",
+        # Without the table its names are unknown; the table error is reported instead.
+        choices=None if table_error else ["all"] + list(TEST_FUNCS.keys()), # Build a list of allowed function names after '--test'
+        default="all",
+        help="Specific test to run (default: all)",
+    )
+    parser.add_argument(
+        "--parallel", "-p",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Run tests on a pool of N worker threads (default: 1, sequential; 100 in flight with --async)",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Run tests on an asyncio event loop from one thread; --parallel caps the tests in flight",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Keep-alive connections per host in the shared session (default: --parallel)",
+    )
+    parser.add_argument(
+        "--output",
+        choices=list(RESULT_WRITERS),
+        default=None,
+        help="Also write one structured record per test: JSON Lines or JUnit XML",
+    )
+    parser.add_argument(
+        "--output-file",
+        metavar="PATH",
+        default=None,
+        help="Where --output writes (default: api-test-results.jsonl / api-test-results.xml)",
+    )
+    parser.add_argument(
+        "--db",
+        metavar="PATH",
+        default=None,
+        help="Append this run's results and latency histograms to a SQLite history database",
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help=f"Print rolling pass rates and latency per test from the history database "
+             f"(--db, default: {DEFAULT_HISTORY_DB}) instead of running tests",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=20,
+        metavar="N",
+        help="With --history, how many of the most recent runs to include (default: 20)",
+    )
+    parser.add_argument(
+        "--json-codec",
+        choices=["auto", "json", "orjson"],
+        default="auto",
+        help="Encoder for request bodies; auto uses orjson when installed (default: auto)",
+    )
+    parser.add_argument(
+        "--max-response-bytes",
+        type=parse_size,
+        default=MAX_RESPONSE_BYTES,
+        metavar="SIZE",
+        help="Read at most this much of each response body, e.g. 256K or 4M (default: 1M)",
+    )
+    parser.add_argument(
+        "--encoding-benchmark",
+        action="store_true",
+        help="Measure client CPU spent encoding requests and exit",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=parse_warmup,
+        metavar="N|DURATION",
+        help="Before measuring, run the tests N times (or for a duration such as 30s) and discard the timings",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Run the selected tests N times, e.g. to collect latency samples for --baseline",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        metavar="FILE",
+        default=None,
+        help="Save this run's per-test latency histograms as a baseline",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        default=None,
+        help="Fail if any test's latency regressed compared with a saved baseline",
+    )
+    parser.add_argument(
+        "--regression-threshold",
+        type=float,
+        default=0.2,
+        metavar="FRACTION",
+        help="With --baseline, the p50/p95 growth that counts as a regression (default: 0.2 = 20%%)",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=5.0,
+        metavar="MS",
+        help="With --baseline, the least p50/p95 growth in milliseconds that counts as a regression (default: 5)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read the success reply incrementally, timing first byte and first token",
+    )
+    parser.add_argument(
+        "--stream-tokens",
+        type=int,
+        default=STREAM_MIN_TOKENS,
+        metavar="N",
+        help=f"With --stream, stop reading after N streamed tokens; 0 reads to the end "
+             f"(default: {STREAM_MIN_TOKENS})",
+    )
+    parser.add_argument(
+        "--phases",
+        action="store_true",
+        help="Time DNS, connect, TLS, time-to-first-byte and body of each request",
+    )
+    load = parser.add_argument_group("load generation (--load)")
+    load.add_argument(
+        "--load",
+        action="store_true",
+        help="Drive the success request at a sustained rate instead of running tests",
+    )
+    load.add_argument(
+        "--users",
+        type=int,
+        default=10,
+        metavar="N",
+        help="Virtual users (closed-loop) or worker threads (open-loop, replay) (default: 10)",
+    )
+    load.add_argument(
+        "--rps",
+        type=float,
+        default=None,
+        help="Open-loop target requests per second (default: closed-loop)",
+    )
+    load.add_argument(
+        "--arrival",
+        choices=["constant", "poisson"],
+        default="constant",
+        help="Open-loop arrival schedule (default: constant)",
+    )
+    load.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed for a reproducible poisson schedule",
+    )
+    load.add_argument(
+        "--duration",
+        type=parse_duration,
+        default=30.0,
+        help="How long to generate load, e.g. 30, 90s, 5m (default: 30s)",
+    )
+    capacity = parser.add_argument_group("capacity search (--capacity)")
+    capacity.add_argument(
+        "--capacity",
+        action="store_true",
+        help="Raise concurrency on the success request until the SLO breaks, then report the maximum",
+    )
+    capacity.add_argument(
+        "--slo-p99",
+        type=float,
+        default=5000.0,
+        metavar="MS",
+        help="Highest acceptable p99 latency in milliseconds (default: 5000)",
+    )
+    capacity.add_argument(
+        "--slo-error-rate",
+        type=float,
+        default=0.01,
+        metavar="FRACTION",
+        help="Highest acceptable error rate, e.g. 0.01 for 1%% (default: 0.01)",
+    )
+    capacity.add_argument(
+        "--step-duration",
+        type=parse_duration,
+        default=10.0,
+        help="How long each concurrency level runs (default: 10s)",
+    )
+    capacity.add_argument(
+        "--max-users",
+        type=int,
+        default=256,
+        metavar="N",
+        help="Highest concurrency to try (default: 256)",
+    )
+    daemon = parser.add_argument_group("monitoring daemon (--daemon)")
+    daemon.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running the selected tests on a schedule in one long-lived process",
+    )
+    daemon.add_argument(
+        "--interval",
+        type=parse_duration,
+        default=60.0,
+        help="Time between runs, e.g. 30s or 5m (default: 60s)",
+    )
+    daemon.add_argument(
+        "--interval-jitter",
+        type=float,
+        default=0.1,
+        metavar="FRACTION",
+        help="Vary each interval randomly by up to this fraction (default: 0.1)",
+    )
+    daemon.add_argument(
+        "--window",
+        type=int,
+        default=60,
+        metavar="N",
+        help="Recent results per test kept for rolling metrics (default: 60)",
+    )
+    conversation = parser.add_argument_group("conversation benchmark (--conversations)")
+    conversation.add_argument(
+        "--conversations",
+        type=int,
+        metavar="N",
+        help="Benchmark N concurrent multi-turn conversations instead of running tests",
+    )
+    conversation.add_argument(
+        "--turns",
+        type=int,
+        default=10,
+        metavar="K",
+        help="Turns per conversation; each resends the growing history (default: 10)",
+    )
+    cold = parser.add_argument_group("cold-start probe (--cold-start)")
+    cold.add_argument(
+        "--cold-start",
+        action="store_true",
+        help="Measure cold starts after idle periods instead of running tests",
+    )
+    cold.add_argument(
+        "--idle-gaps",
+        type=parse_durations,
+        default=[0.0, 60.0, 300.0, 900.0],
+        metavar="LIST",
+        help="Comma-separated idle periods before each probe (default: 0,1m,5m,15m)",
+    )
+    cold.add_argument(
+        "--probes",
+        type=int,
+        default=3,
+        metavar="N",
+        help="Probes per idle gap (default: 3)",
+    )
+    sweep = parser.add_argument_group("payload sweep (--payload-sweep)")
+    sweep.add_argument(
+        "--payload-sweep",
+        action="store_true",
+        help="Find payload size and message count limits instead of running tests",
+    )
+    sweep.add_argument(
+        "--max-payload",
+        type=parse_size,
+        default=16 * 1024 * 1024,
+        metavar="SIZE",
+        help="Largest payload on the size ladder, e.g. 512K or 16M (default: 16M)",
+    )
+    sweep.add_argument(
+        "--max-messages",
+        type=int,
+        default=4096,
+        metavar="N",
+        help="Most messages on the message-count ladder (default: 4096)",
+    )
+    sweep.add_argument(
+        "--sweep-samples",
+        type=int,
+        default=3,
+        metavar="N",
+        help="Requests per sweep step; the median is reported (default: 3)",
+    )
+    metrics = parser.add_argument_group("metrics export")
+    metrics.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="With --daemon, serve Prometheus/OpenMetrics metrics at http://HOST:PORT/metrics",
+    )
+    metrics.add_argument(
+        "--metrics-host",
+        default="127.0.0.1",
+        help="Address the metrics endpoint listens on (default: 127.0.0.1)",
+    )
+    metrics.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="Write metrics for node_exporter's textfile collector after each run (e.g. api_test.prom)",
+    )
+    replay = parser.add_argument_group("traffic replay (--replay)")
+    replay.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="Replay a JSON Lines traffic capture against the endpoint instead of running tests",
+    )
+    replay.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay speed multiplier; 10 sends the capture ten times faster (default: 1)",
+    )
+    args = parser.parse_args()
+    if table_error:
+        parser.error(f"cannot load the test case table: {table_error}")
+    if args.max_users < 1:
+        parser.error("--max-users must be at least 1")
+    if not 0.0 <= args.slo_error_rate <= 1.0:
+        parser.error("--slo-error-rate must be between 0 and 1")
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+    if args.rps is not None and args.rps <= 0:
+        parser.error("--rps must be positive")
+    if args.parallel is None:
+        args.parallel = 100 if args.use_async else 1
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.env == "both":
+        for option in ("load", "replay", "capacity", "history", "baseline", "save_baseline"):
+            if getattr(args, option):
+                parser.error(f"--{option.replace('_', '-')} cannot be used with --env both")
+    if args.daemon:
+        for option in ("load", "replay", "capacity", "history", "baseline", "save_baseline"):
+            if getattr(args, option):
+                parser.error(f"--{option.replace('_', '-')} cannot be used with --daemon")
+        if args.env == "both":
+            parser.error("--env both cannot be used with --daemon")
+        if args.output == "junit":
+            parser.error("--output junit cannot be used with --daemon; use --output json")
+    if args.conversations is not None:
+        if args.conversations < 1:
+            parser.error("--conversations must be at least 1")
+        if args.load or args.replay or args.capacity or args.daemon or args.env == "both":
+            parser.error("--conversations cannot be used with --load, --replay, --capacity, "
+                         "--daemon or --env both")
+    if args.payload_sweep and (args.load or args.replay or args.capacity or args.daemon
+                               or args.conversations or args.env == "both"):
+        parser.error("--payload-sweep cannot be combined with other benchmark modes or --env both")
+    if args.cold_start and (args.load or args.replay or args.capacity or args.daemon or args.conversations
+                            or args.payload_sweep or args.env == "both"):
+        parser.error("--cold-start cannot be combined with other benchmark modes or --env both")
+    if args.warmup and (args.cold_start or args.env == "both"):
+        parser.error("--warmup cannot be used with --cold-start or --env both")
+    if not args.idle_gaps:
+        parser.error("--idle-gaps needs at least one duration")
+    if args.probes < 1:
+        parser.error("--probes must be at least 1")
+    if args.max_payload < 1024:
+        parser.error("--max-payload must be at least 1K")
+    if args.max_messages < 1:
+        parser.error("--max-messages must be at least 1")
+    if args.sweep_samples < 1:
+        parser.error("--sweep-samples must be at least 1")
+    if args.turns < 1:
+        parser.error("--turns must be at least 1")
+    if args.metrics_port is not None and not args.daemon:
+        parser.error("--metrics-port requires --daemon; use --metrics-file for single runs")
+    if args.metrics_file and (args.load or args.replay or args.capacity or args.env == "both"):
+        parser.error("--metrics-file cannot be used with --load, --replay, --capacity or --env both")
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+    if not 0.0 <= args.interval_jitter < 1.0:
+        parser.error("--interval-jitter must be at least 0 and below 1")
+    if args.window < 1:
+        parser.error("--window must be at least 1")
+    if args.regression_threshold < 0:
+        parser.error("--regression-threshold must not be negative")
+    if args.min_delta_ms < 0:
+        parser.error("--min-delta-ms must not be negative")
+    if args.output:
+        # Catch the common mistake here; open_result_writer reports anything else.
+        output_dir = os.path.dirname(os.path.abspath(args.output_file or RESULT_WRITERS[args.output][1]))
+        if not os.path.isdir(output_dir):
+            parser.error(f"--output-file: directory {output_dir} does not exist")
+    if args.db and not args.history and not os.path.isdir(os.path.dirname(os.path.abspath(args.db))):
+        parser.error(f"--db: directory {os.path.dirname(os.path.abspath(args.db))} does not exist")
+    # Read the baseline now, so a missing or malformed file fails before the run, not after.
+    args.baseline_tests = None
+    if args.baseline:
+        try:
+            args.baseline_tests = load_baseline(args.baseline)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot load --baseline: {e}")
+    if args.runs < 1:
+        parser.error("--runs must be at least 1")
+    if args.stream_tokens < 0:
+        parser.error("--stream-tokens must not be negative")
+    if args.max_response_bytes < 1024:
+        parser.error("--max-response-bytes must be at least 1K")
+    if args.pool_size is not None and args.pool_size < 1:
+        parser.error("--pool-size must be at least 1")
+    return args
+
+
+def _median(values: list) -> float | None:
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def run_env_comparison(targets: dict, api_key: str, args, on_record=None) -> dict:
+    """Run the selected tests against every {env: url} in targets at the same time.
+
+    Each environment runs on its own thread (with --parallel/--async applying within
+    it) and its output is buffered, then printed one environment after the other.
+    Returns {env: results} with results as from run_all_tests, every record tagged
+    with its env.
+    """
+    def run_env(stdout: ContextStdout, env: str, url: str) -> tuple[dict, str]:
+        def tag(record: dict):
+            record["env"] = env
+            if on_record:
+                on_record(record)
+
+        results = {"passed": 0, "failed": 0, "details": [], "records": []}
+        with stdout.capture() as buffer:
+            for _ in range(args.repeat):
+                if args.test != "all":
+                    run = {"passed": 0, "failed": 0, "details": [], "records": []}
+                    _record_result(run, run_test(args.test, url, api_key, args.verbose), tag)
+                elif args.use_async:
+                    run = asyncio.run(run_all_tests_async(url, api_key, args.verbose, args.parallel, tag))
+                else:
+                    run = run_all_tests(url, api_key, args.verbose, args.parallel, tag)
+                for key in results:
+                    results[key] += run[key]
+        return results, buffer.getvalue()
+
+    all_results = {}
+    with buffered_stdout() as stdout, futures.ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        pending = {env: pool.submit(run_env, stdout, env, url) for env, url in targets.items()}
+        for env, future in pending.items():
+            results, output = future.result()
+            print(f"\n{'='*60}")
+            print(f"Environment: {env.upper()} ({targets[env]})")
+            print(f"{'='*60}", end="")
+            stdout.write(output)
+            stdout.flush()
+            all_results[env] = results
+    return all_results
+
+
+def print_env_comparison(all_results: dict):
+    """Print a per-test status and median latency diff between environments."""
+    envs = list(all_results)
+    tests = {}
+    for env, results in all_results.items():
+        for record in results["records"]:
+            tests.setdefault(record["name"], {}).setdefault(env, []).append(record)
+
+    print(f"\n{'='*60}")
+    print(f"COMPARISON ({' vs '.join(env.upper() for env in envs)})")
+    print(f"{'='*60}")
+    header = "  ".join(f"{env + ' status':>12} {env + ' p50':>10}" for env in envs)
+    print(f"  {'test':<20} {header} {'delta':>8}")
+    differences = 0
+    for name, by_env in tests.items():
+        cells, statuses, medians = [], [], []
+        for env in envs:
+            records = by_env.get(env, [])
+            passed = sum(record["passed"] for record in records)
+            codes = sorted({str(record["status_code"]) for record in records})
+            status = f"{'/'.join(codes)} {'PASS' if records and passed == len(records) else 'FAIL'}"
+            median = _median([record["latency_ms"] for record in records])
+            statuses.append(status)
+            medians.append(median)
+            cells.append(f"{status:>12} {'-' if median is None else f'{median:.1f}ms':>10}")
+        delta = ""
+        if len(medians) == 2 and None not in medians and medians[0]:
+            delta = f"{(medians[1] - medians[0]) / medians[0]:+.0%}"
+        mismatch = len(set(statuses)) > 1
+        differences += mismatch
+        print(f"  {name:<20} {'  '.join(cells)} {delta:>8}{'  ≠' if mismatch else ''}")
+    if differences:
+        print(f"\n{differences} test(s) behave differently between environments (≠)")
+    else:
+        print("\nAll tests behave the same in every environment")
+
+
+def _latencies_from_records(records: list) -> dict:
+    """Build LATENCIES-style (test, status) histograms from result records."""
+    latencies = {}
+    for record in records:
+        histogram = latencies.setdefault((record["name"], record["status_code"]), LatencyHistogram())
+        histogram.record(record["latency_ms"] / 1000)
+    return latencies
+
+
+def main_both_envs(args, api_key: str):
+    """--env both: run the suite against prod and test together and compare them."""
+    try:
+        targets = {env: get_api_url(env) for env in ("prod", "test")}
+    except EnvironmentError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
+    print(f"\n{'='*60}")
+    print("API Test Suite - Environment: PROD + TEST")
+    for env, url in targets.items():
+        print(f"{env.upper()} URL: {url}")
+    print(f"{'='*60}")
+
+    global HTTP_SESSION
+    session = HTTP_SESSION = create_session(args.pool_size or 2 * args.parallel, phase_timing=args.phases)
+    for url in targets.values():
+        try:
+            session.head(url, timeout=5)
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Error: Cannot reach URL {url} - {e}")
+            sys.exit(1)
+
+    writer = open_result_writer(args, {"env": "both"})
+    try:
+        all_results = run_env_comparison(targets, api_key, args, writer.write if writer else None)
+    finally:
+        if writer:
+            writer.close()
+    if args.db:
+        for env, results in all_results.items():
+            try_save_run_history(args.db, env, targets[env], results["records"],
+                                 _latencies_from_records(results["records"]))
+
+    print_env_comparison(all_results)
+    failed = sum(results["failed"] for results in all_results.values())
+    if failed:
+        print(f"\n❌ {failed} test run(s) failed")
+        sys.exit(1)
+    print("\n✅ All tests passed in both environments!")
+    sys.exit(0)
+
+
+class RollingWindow:
+    """Ring buffers of the most recent results per test, for daemon-mode metrics.
+
+    Memory stays fixed however long the daemon runs: each test keeps at most
+    `size` results and the window keeps at most `size` cycle summaries.
+    """
+
+    def __init__(self, size: int = 60):
+        self.size = size
+        self.results = {}
+        self.cycles = deque(maxlen=size)
+
+    def add_cycle(self, started: float, duration: float, records: list):
+        self.cycles.append((started, duration, sum(record["passed"] for record in records), len(records)))
+        for record in records:
+            results = self.results.setdefault(record["name"], deque(maxlen=self.size))
+            results.append((record["passed"], record["latency_ms"], record["status_code"]))
+
+    def summary(self) -> dict:
+        """Return {test: {"runs", "pass_rate", "latency", "last_status", "last_passed"}}."""
+        summary = {}
+        for name, results in self.results.items():
+            histogram = LatencyHistogram()
+            for _, latency_ms, _ in results:
+                if latency_ms is not None:
+                    histogram.record(latency_ms / 1000)
+            passed, _, status = results[-1]
+            summary[name] = {
+                "runs": len(results),
+                "pass_rate": sum(result[0] for result in results) / len(results),
+                "latency": histogram.summary() if histogram.total else None,
+                "last_status": status,
+                "last_passed": passed,
+            }
+        return summary
+
+
+def print_rolling_window(window: RollingWindow, file=None):
+    """Print per-test pass rate and latency over the daemon's recent results (to file, default stdout)."""
+    file = file or sys.stdout
+    print(f"\n{'='*60}", file=file)
+    print(f"ROLLING METRICS (last {window.size} runs per test, {len(window.cycles)} cycles)", file=file)
+    print(f"{'='*60}", file=file)
+    print(f"  {'test':<20} {'runs':>5} {'pass':>7} {'p50 ms':>9} {'p99 ms':>9}   last", file=file)
+    for name, metrics in window.summary().items():
+        latency = metrics["latency"] or {}
+        p50, p99 = (f"{latency[key] * 1000:.1f}" if key in latency else "-" for key in (50, 99))
+        last = f"{metrics['last_status']} {'PASS' if metrics['last_passed'] else 'FAIL'}"
+        print(f"  {name:<20} {metrics['runs']:>5} {metrics['pass_rate']:>7.1%} {p50:>9} {p99:>9}   {last}",
+              file=file)
+    file.flush()
+
+
+def run_daemon(url: str, api_key: str, args, on_record=None, on_cycle=None,
+               loop=None, client: AsyncHTTPClient | None = None) -> tuple[RollingWindow, dict]:
+    """Run the selected tests every --interval (jittered) until interrupted.
+
+    The shared session stays open between cycles, so connections (and TLS sessions)
+    are reused instead of re-established by a fresh process; with --async, client,
+    an AsyncHTTPClient driven on loop, serves every cycle for the same reason and is
+    closed, with the loop, when the daemon stops. Each cycle prints one line, plus
+    the full test output when something failed. SIGTERM stops the daemon like Ctrl-C,
+    and SIGUSR1 prints the rolling metrics without stopping it. on_cycle, if given,
+    is called with each cycle's records. Returns the rolling window and the
+    {"opened", "requests"} counts of the async client during the daemon's run.
+    """
+    window = RollingWindow(args.window)
+    async_connections = {"opened": 0, "requests": 0}
+    if client is not None:
+        opened, sent = client.opened, client.requests
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if hasattr(signal, "SIGUSR1"):
+        # Mid-cycle, sys.stdout is the cycle's capture buffer; write past it to the real stdout.
+        signal.signal(signal.SIGUSR1, lambda *_: print_rolling_window(window, sys.__stdout__))
+
+    cycle = 0
+    next_run = time.monotonic()
+    try:
+        while True:
+            delay = next_run - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            cycle += 1
+            started = time.monotonic()
+            # Offsetting each interval randomly keeps many probes from hitting the API in step.
+            next_run = started + args.interval * (1 + random.uniform(-args.interval_jitter,
+                                                                     args.interval_jitter))
+            started_at = datetime.now(timezone.utc)
+            with buffered_stdout() as stdout, stdout.capture() as output:
+                if args.test != "all":
+                    records = [run_test(args.test, url, api_key, args.verbose)]
+                    if on_record:
+                        on_record(records[0])
+                elif client is not None:
+                    records = loop.run_until_complete(run_all_tests_async(
+                        url, api_key, args.verbose, args.parallel, on_record, client))["records"]
+                else:
+                    records = run_all_tests(url, api_key, args.verbose, args.parallel, on_record)["records"]
+            duration = time.monotonic() - started
+            window.add_cycle(started_at.timestamp(), duration, records)
+            if on_cycle:
+                on_cycle(records)
+
+            failed = [record["name"] for record in records if not record["passed"]]
+            if failed:
+                sys.stdout.write(output.getvalue())
+            status = f"❌ failed: {', '.join(failed)}" if failed else "✅"
+            print(f"[{started_at.isoformat(timespec='seconds')}] cycle {cycle}: "
+                  f"{len(records) - len(failed)}/{len(records)} passed in {duration:.2f}s {status}")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if client is not None:
+            async_connections = {"opened": client.opened - opened, "requests": client.requests - sent}
+            loop.run_until_complete(client.close())
+            loop.close()
+    return window, async_connections
+
+
+def check_baseline(args) -> list:
+    """Save and/or compare against a latency baseline as requested; return the regressed tests."""
+    if args.save_baseline:
+        save_baseline(args.save_baseline, args.env, LATENCIES)
+        print(f"\nSaved latency baseline to {args.save_baseline}")
+    if not args.baseline:
+        return []
+    comparisons = compare_to_baseline(args.baseline_tests, LATENCIES, args.regression_threshold,
+                                      min_delta=args.min_delta_ms / 1000)
+    print_baseline_comparison(comparisons, args.baseline)
+    return [comparison["name"] for comparison in comparisons if comparison["verdict"] == "regressed"]
+
+
+def main():
+    """Main entry point."""
+    # The table goes first: its cases are --test choices.
+    try:
+        register_test_cases(load_test_cases(TEST_CASES_PATH))
+        table_error = None
+    except (OSError, ValueError) as e:
+        table_error = e
+    args = parse_args(table_error)
+
+    # Mode globals go first: every run below, --env both included, reads them.
+    global JSON_CODEC, MAX_RESPONSE_BYTES, STREAM_RESPONSES, STREAM_MIN_TOKENS
+    JSON_CODEC = args.json_codec
+    MAX_RESPONSE_BYTES = args.max_response_bytes
+    STREAM_RESPONSES = args.stream
+    STREAM_MIN_TOKENS = args.stream_tokens
+    if JSON_CODEC == "orjson" and importlib.util.find_spec("orjson") is None:
+        print(f"❌ Error: --json-codec {JSON_CODEC} needs the {JSON_CODEC} package (pip install {JSON_CODEC})")
+        sys.exit(1)
+
+    if args.encoding_benchmark:
+        iterations = 20000
+        print_encoding_benchmark(run_encoding_benchmark(iterations), iterations)
+        sys.exit(0)
+
+    if args.history:
+        db_path = args.db or DEFAULT_HISTORY_DB
+        if not os.path.exists(db_path):
+            print(f"❌ Error: History database {db_path} does not exist")
+            sys.exit(1)
+        try:
+            history = load_history(db_path, args.env, args.runs)
+        except (sqlite3.Error, OSError) as e:
+            print(f"❌ Error: Cannot read history database {db_path} - {e}")
+            sys.exit(1)
+        print_history(history, args.env, args.runs)
+        sys.exit(0)
+
+    if args.env == "both":
+        try:
+            api_key = get_api_key()
+        except EnvironmentError as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        main_both_envs(args, api_key)
+
+    if args.replay:
+        try:
+            open(args.replay, encoding="utf-8").close()
+        except OSError as e:
+            print(f"❌ Error: Cannot read traffic capture {args.replay} - {e.strerror}")
+            sys.exit(1)
+
+    # Get API key and URL
+    try:
+        api_key = get_api_key()
+        url = get_api_url(args.env)
+    except EnvironmentError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
+    print(f"\n{'='*60}")
+    print(f"API Test Suite - Environment: {args.env.upper()}")
+    print(f"URL: {url}")
+    print(f"{'='*60}")
+
+    global HTTP_SESSION
+    pool_size = args.pool_size or (args.max_users if args.capacity else
+                                   args.users if args.load or args.replay else
+                                   args.conversations if args.conversations else
+                                   len(COLD_START_REQUESTS) if args.cold_start else
+                                   args.parallel)
+    session = HTTP_SESSION = create_session(pool_size,
+                                            phase_timing=args.phases or args.payload_sweep or args.cold_start)
+
+    # Quick connectivity test to the URL
+    try:
+        session.head(url, timeout=5)
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Error: Cannot reach URL {url} - {e}")
+        sys.exit(1)
+
+    # With --async the suite runs on one event loop and AsyncHTTPClient, shared by the
+    # warmup and every repeat (or daemon cycle), so measured runs reuse its connections.
+    async_loop = async_client = None
+    if args.use_async and args.test == "all" and not (args.capacity or args.load or args.replay
+                                                      or args.conversations or args.payload_sweep
+                                                      or args.cold_start):
+        async_loop = asyncio.new_event_loop()
+        async_client = AsyncHTTPClient(pool_size=args.parallel)
+
+    connections_before = None
+    if args.warmup:
+        warmup = run_warmup(url, api_key, args.warmup, pool_size, async_loop, async_client)
+        print(f"\nWarmup: {warmup['tests']} tests and up to {pool_size} connections in "
+              f"{warmup['elapsed']:.1f}s ({warmup['failed']} failed), timings discarded")
+        connections_before = connection_stats(session)
+
+    if args.capacity:
+        print(f"\nSearching for capacity (SLO: p99 <= {args.slo_p99:g}ms, "
+              f"errors <= {args.slo_error_rate:.2%}, {args.step_duration:g}s per step)")
+        result = find_capacity(url, api_key, args.slo_p99 / 1000, args.slo_error_rate,
+                               args.step_duration, args.max_users, print_capacity_step)
+        capacity, peak = result["capacity"], result["peak"]
+        print(f"\n{'='*60}")
+        print("CAPACITY SUMMARY")
+        print(f"{'='*60}")
+        if capacity is None:
+            print("❌ No concurrency level met the SLO")
+            sys.exit(1)
+        print(f"Max sustainable concurrency: {capacity['users']} users at {capacity['throughput']:.1f} req/s")
+        print(f"Latency:     {_format_latency(capacity['latency'])}")
+        print(f"Error rate:  {capacity['error_rate']:.2%}")
+        if peak is not capacity:
+            print(f"Peak throughput: {peak['throughput']:.1f} req/s at {peak['users']} users")
+        sys.exit(0)
+
+    if args.replay:
+        report = run_replay(url, api_key, args.replay, args.speed, args.users)
+        print_replay_report(report)
+        failed = sum(report["mismatches"].values()) + report["status_counts"].get(None, 0) + report["dropped"]
+        sys.exit(1 if failed else 0)
+
+    if args.cold_start:
+        idle = sum(args.idle_gaps) * args.probes
+        print(f"\nProbing cold starts after {', '.join(f'{gap:g}s' for gap in args.idle_gaps)} idle, "
+              f"{args.probes} probes each (at least {idle / 60:.1f} minutes); "
+              f"server wait after idle vs back to back:")
+        report = run_cold_start(url, api_key, args.idle_gaps, args.probes, on_probe=print_cold_start_probe)
+        print_cold_start_report(report)
+        sys.exit(1 if any(result["errors"] for result in report["kinds"].values()) else 0)
+
+    if args.payload_sweep:
+        print(f"\nSweeping payloads up to {_format_size(args.max_payload)} and {args.max_messages} "
+              f"messages ({args.sweep_samples} requests per step, medians in ms)")
+        print(f"  {'ladder':<8} {'step':>8} {'size':>9} {'serialize':>9} {'upload':>9} {'server':>9} "
+              f"{'total':>9}   status")
+        report = run_payload_sweep(url, api_key, args.max_payload, args.max_messages, args.sweep_samples,
+                                   print_sweep_step)
+        print_sweep_report(report)
+        sys.exit(0)
+
+    if args.conversations:
+        report = run_conversations(url, api_key, args.conversations, args.turns)
+        print_conversation_report(report)
+        sys.exit(1 if report["errors"] else 0)
+
+    if args.load:
+        report = run_load(url, api_key, args.duration, args.users, args.rps, args.arrival, args.seed)
+        print_load_report(report)
+        sys.exit(1 if report["errors"] or report["dropped"] else 0)
+
+    writer = open_result_writer(args, {"env": args.env, "url": url})
+    on_record = writer.write if writer else None
+    metrics = None
+    if args.metrics_port is not None or args.metrics_file:
+        metrics = TestMetrics(args.env)
+
+        def on_record(record, write=on_record):
+            metrics.observe(record)
+            if write:
+                write(record)
+
+    if args.daemon:
+        print(f"\nMonitoring every {args.interval:g}s (±{args.interval_jitter:.0%}); "
+              f"Ctrl-C or SIGTERM stops, SIGUSR1 prints rolling metrics")
+        if args.metrics_port is not None:
+            try:
+                metrics.serve(args.metrics_host, args.metrics_port)
+            except OSError as e:
+                print(f"❌ Error: Cannot serve metrics on {args.metrics_host}:{args.metrics_port} - {e}")
+                sys.exit(1)
+            print(f"Metrics at http://{args.metrics_host}:{args.metrics_port}/metrics")
+
+        def on_cycle(records):
+            if args.db:
+                try_save_run_history(args.db, args.env, url, records, _latencies_from_records(records))
+            if args.metrics_file:
+                metrics.write_textfile(args.metrics_file)
+
+        try:
+            window, async_connections = run_daemon(url, api_key, args, on_record, on_cycle,
+                                                   async_loop, async_client)
+        finally:
+            if writer:
+                writer.close()
+        print_rolling_window(window)
+        stats = connection_stats(session, since=connections_before, extra=async_connections)
+        print(f"Connections: {stats['opened']} opened, {stats['reused']} reused "
+              f"({stats['requests']} requests)")
+        sys.exit(0)
+
+    # Run tests
+    if args.test == "all":
+        results = {"passed": 0, "failed": 0, "details": [], "records": []}
+        async_connections = {"opened": 0, "requests": 0}
+        try:
+            for _ in range(args.repeat):
+                if async_client is not None:
+                    run = async_loop.run_until_complete(run_all_tests_async(
+                        url, api_key, args.verbose, args.parallel, on_record, async_client))
+                    for key in async_connections:
+                        async_connections[key] += run["connections"][key]
+                else:
+                    run = run_all_tests(url, api_key, args.verbose, args.parallel, on_record)
+                for key in results:
+                    results[key] += run[key]
+        finally:
+            if writer:
+                writer.close()
+            if async_client is not None:
+                async_loop.run_until_complete(async_client.close())
+                async_loop.close()
+        if args.db:
+            try_save_run_history(args.db, args.env, url, results["records"], LATENCIES)
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+
+        # Print summary
+        print(f"\n{'='*60}")
+        print("SUMMARY")
+        print(f"{'='*60}")
+        print(f"Passed: {results['passed']}")
+        print(f"Failed: {results['failed']}")
+        print(f"Total:  {results['passed'] + results['failed']}")
+        stats = connection_stats(session, since=connections_before, extra=async_connections)
+        print(f"Connections: {stats['opened']} opened, {stats['reused']} reused "
+              f"({stats['requests']} requests)")
+        print_latency_table(LATENCIES)
+        print_phase_table(PHASE_LATENCIES)
+        print_stream_table(STREAM_LATENCIES)
+        regressed = check_baseline(args)
+
+        if results["failed"] > 0:
+            print("\nFailed tests:")
+            for name, passed in dict.fromkeys(results["details"]):
+                if not passed:
+                    print(f"  - {name}")
+            sys.exit(1)
+        elif regressed:
+            print(f"\n❌ Latency regressed: {', '.join(regressed)}")
+            sys.exit(1)
+        else:
+            print("\n✅ All tests passed!")
+            sys.exit(0)
+    else:
+        # Run single test
+        records = []
+        try:
+            for _ in range(args.repeat):
+                records.append(run_test(args.test, url, api_key, args.verbose))
+                if on_record:
+                    on_record(records[-1])
+        finally:
+            if writer:
+                writer.close()
+        if args.db:
+            try_save_run_history(args.db, args.env, url, records, LATENCIES)
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+        regressed = check_baseline(args)
+        sys.exit(0 if all(record["passed"] for record in records) and not regressed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/bin/bash
+# Measure api-test.py startup time, i.e. what every cron probe pays before sending a request
+# Usage: ./bench_startup.sh [runs]
+# Examples:
+#   ./bench_startup.sh
+#   ./bench_startup.sh 50
+#   TEST_API_URL=https://test.example.com/chat API_KEY=... ./bench_startup.sh
+# The probe (one -t missing-key test) runs against TEST_API_URL when it is set,
+# otherwise against a local mock-server.py started for the benchmark.
+
+#SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd -P)"
+SCRIPT_DIR="$(dirname "$(realpath -- "${BASH_SOURCE[0]}")")"
+RUNS="${1:-20}"
+
+# Print the mean wall time of RUNS invocations of the given command, in milliseconds
+_bench() {
+    local label="$1"
+    shift
+    local started ended
+    started=$(date +%s%N)
+    for ((i = 0; i < RUNS; i++)); do
+        "$@" >/dev/null 2>&1
+    done
+    ended=$(date +%s%N)
+    printf "%-28s %8.1f ms\n" "$label" "$(( (ended - started) / RUNS / 1000 ))e-3"
+}
+
+if [ -z "$TEST_API_URL" ]; then
+    PORT=$(python3 -c 'import socket; s = socket.socket(); s.bind(("127.0.0.1", 0)); print(s.getsockname()[1])')
+    python3 "$SCRIPT_DIR/mock-server.py" --port "$PORT" --api-key bench-key >/dev/null 2>&1 &
+    MOCK_PID=$!
+    trap 'kill "$MOCK_PID" 2>/dev/null' EXIT
+    export TEST_API_URL="http://127.0.0.1:$PORT/chat" API_KEY=bench-key
+    for ((i = 0; i < 50; i++)); do
+        (: </dev/tcp/127.0.0.1/"$PORT") 2>/dev/null && break
+        sleep 0.1
+    done
+fi
+export API_KEY="${API_KEY:-bench-key}"
+
+# Compile the bytecode cache first so the first run does not skew the mean
+python3 "$SCRIPT_DIR/api-test.py" --help >/dev/null
+
+echo "Mean wall time over $RUNS runs:"
+_bench "python3 (bare interpreter)" python3 -c pass
+_bench "api-test.py --help" python3 "$SCRIPT_DIR/api-test.py" --help
+_bench "missing API_KEY" env -u API_KEY python3 "$SCRIPT_DIR/api-test.py"
+_bench "probe (-t missing-key)" python3 "$SCRIPT_DIR/api-test.py" --env test -t missing-key
+_bench "import requests" python3 -c "import requests"
+_bench "import asyncio" python3 -c "import asyncio"
+
+# Anything the HTTP stack or a single mode pulls in at import time shows up here;
+# it should be empty
+echo
+echo "Heavy modules loaded by --help (should be none):"
+python3 -X importtime "$SCRIPT_DIR/api-test.py" --help 2>&1 >/dev/null \
+    | grep -E '\| (requests|urllib3|asyncio|ssl|charset_normalizer|socket|sqlite3|xml\.etree\.ElementTree|concurrent\.futures|orjson)$' \
+    || echo "  none"
+
+# The probe needs requests (and the socket module it imports) and the JSON encoder, nothing else
+echo
+echo "Mode-only modules loaded by the probe (should be none):"
+python3 -X importtime "$SCRIPT_DIR/api-test.py" --env test -t missing-key 2>&1 >/dev/null \
+    | grep -E '\| (asyncio|sqlite3|xml\.etree\.ElementTree|concurrent\.futures)$' \
+    || echo "  none"
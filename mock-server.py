@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Mock PromptGPT Backend
+
+Local stand-in for the PromptGPT API that implements the contract api-test.py
+checks, so the harness can be benchmarked and regression-tested offline without
+spending LLM tokens. Built on asyncio streams with HTTP/1.1 keep-alive, so it can
+serve thousands of requests per second with injected latency.
+
+Usage:
+    python mock-server.py --port 8080
+    python mock-server.py --latency 0.2 --jitter 0.1 --error-rate 0.01
+    python mock-server.py --stream --token-delay 0.02
+    python mock-server.py --cold-start 1.5 --idle-timeout 60
+
+Then point the tests at it:
+    API_KEY=test-key TEST_API_URL=http://127.0.0.1:8080/chat python api-test.py --env test
+
+Environment Variables:
+    API_KEY: API key the server accepts (default: test-key; --api-key overrides)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST,OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type,X-Api-Key",
+}
+
+MAX_HEADER_LINES = 100
+
+
+class MockBackend:
+    """Answers PromptGPT requests the way the real backend does, with injected latency and errors."""
+
+    def __init__(self, api_key: str, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, max_body: int = 10 * 1024 * 1024,
+                 stream: bool = False, token_delay: float = 0.0, reply: str = "Hello test",
+                 cold_start: float = 0.0, idle_timeout: float = 0.0):
+        self.api_key = api_key
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_body = max_body
+        self.stream = stream
+        self.token_delay = token_delay
+        self.reply = reply
+        self.cold_start = cold_start
+        self.idle_timeout = idle_timeout
+        self.last_finished = None
+        self.requests = 0
+
+    def validate(self, headers: dict, body: bytes) -> tuple[int, dict]:
+        """Check a chat request and return (status, JSON reply) as the real API would."""
+        if headers.get("x-api-key") != self.api_key:
+            return 403, {"message": "Forbidden"}
+        if not body.strip():
+            return 400, {"error": "Request body is required"}
+        try:
+            data = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return 400, {"error": "Invalid JSON in request body"}
+        if not isinstance(data, dict) or not data.get("threadId"):
+            return 400, {"error": "threadId is required"}
+        messages = data.get("messages")
+        if not isinstance(messages, list):
+            return 400, {"error": "messages must be an array"}
+        if not messages:
+            return 400, {"error": "messages array cannot be empty"}
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {"error": "Internal server error (injected)"}
+        return 200, {"threadId": data["threadId"], "assistant": {"role": "assistant", "content": self.reply}}
+
+    async def delay(self):
+        """Sleep for the configured latency plus a uniform random jitter.
+
+        With cold_start, a request arriving after more than idle_timeout seconds
+        without a finished request also pays the cold-start delay, as a serverless
+        function does; requests already in flight then are all cold.
+        """
+        seconds = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        now = asyncio.get_running_loop().time()
+        if self.cold_start and (self.last_finished is None or now - self.last_finished > self.idle_timeout):
+            seconds += self.cold_start
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+        self.last_finished = asyncio.get_running_loop().time()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve keep-alive requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, _path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                else:
+                    await self.respond(writer, 431, {"message": "Request header fields too large"}, close=True)
+                    break
+
+                content_length = headers.get("content-length") or "0"
+                if not (content_length.isascii() and content_length.isdigit()):
+                    # The body cannot be framed, so the connection cannot be reused either.
+                    await self.respond(writer, 400, {"message": "Bad Request"}, close=True)
+                    break
+                length = int(content_length)
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and version.upper() == "HTTP/1.1")
+                self.requests += 1
+                if length > self.max_body:
+                    # Drain the oversized body so the client sees the 413 instead of a reset.
+                    while length > 0:
+                        length -= len(await reader.readexactly(min(length, 65536)))
+                    await self.respond(writer, 413, {"message": "Request Too Long"}, close=not keep_alive)
+                    if not keep_alive:
+                        break
+                    continue
+                body = await reader.readexactly(length) if length else b""
+
+                if method == "OPTIONS":
+                    await self.respond(writer, 200, None, CORS_HEADERS, close=not keep_alive)
+                elif method == "HEAD":
+                    await self.respond(writer, 403, None, close=not keep_alive)
+                elif method != "POST":
+                    await self.respond(writer, 403, {"message": "Missing Authentication Token"},
+                                       close=not keep_alive)
+                else:
+                    await self.delay()
+                    status, reply = self.validate(headers, body)
+                    if status == 200 and self.stream:
+                        await self.respond_stream(writer, reply["assistant"]["content"], close=not keep_alive)
+                    else:
+                        await self.respond(writer, status, reply, CORS_HEADERS, close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, reply: dict | None,
+                      extra_headers: dict | None = None, close: bool = False):
+        """Write a complete response with an optional JSON body."""
+        body = json.dumps(reply).encode("utf-8") if reply is not None else b""
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}"]
+        if reply is not None:
+            lines.append("Content-Type: application/json")
+        lines.append(f"Content-Length: {len(body)}")
+        lines += [f"{name}: {value}" for name, value in (extra_headers or {}).items()]
+        if close:
+            lines.append("Connection: close")
+        # Headers and body go out in one write so small replies fit in one segment.
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def respond_stream(self, writer: asyncio.StreamWriter, content: str, close: bool = False):
+        """Write the reply as server-sent events, one word per event, in chunked encoding."""
+        lines = ["HTTP/1.1 200 OK", "Content-Type: text/event-stream", "Cache-Control: no-cache",
+                 "Transfer-Encoding: chunked"]
+        lines += [f"{name}: {value}" for name, value in CORS_HEADERS.items()]
+        if close:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+        def chunk(data: bytes) -> bytes:
+            return f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n"
+
+        words = content.split(" ")
+        for position, word in enumerate(words):
+            token = word if position == len(words) - 1 else word + " "
+            event = {"delta": {"content": token}}
+            writer.write(chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8")))
+            await writer.drain()
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        writer.write(chunk(b"data: [DONE]\n\n") + b"0\r\n\r\n")
+        await writer.drain()
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Run a local mock of the PromptGPT backend for offline testing.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+    python mock-server.py --port 8080
+    python mock-server.py --latency 0.2 --jitter 0.1 --error-rate 0.01
+    python mock-server.py --stream --token-delay 0.02
+    python mock-server.py --cold-start 1.5 --idle-timeout 60
+        """,
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument(
+        "--api-key",
+        default=os.environ.get("API_KEY", "test-key"),
+        help="API key to accept in X-Api-Key (default: $API_KEY or test-key)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds to wait before answering each POST (default: 0)",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Extra uniform random delay of up to this many seconds (default: 0)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of valid requests answered with 500 (default: 0)",
+    )
+    parser.add_argument(
+        "--max-body",
+        type=int,
+        default=10 * 1024 * 1024,
+        help="Largest request body in bytes before answering 413 (default: 10 MiB, as API Gateway)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Answer valid requests with server-sent events, one word per event",
+    )
+    parser.add_argument(
+        "--token-delay",
+        type=float,
+        default=0.0,
+        help="With --stream, seconds between events (default: 0)",
+    )
+    parser.add_argument(
+        "--cold-start",
+        type=float,
+        default=0.0,
+        help="Extra seconds for the first POST after --idle-timeout without requests (default: 0)",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=0.0,
+        help="Seconds without requests after which the next POST is cold (default: 0)",
+    )
+    parser.add_argument(
+        "--reply",
+        default="Hello test",
+        help="Assistant content to reply with (default: 'Hello test')",
+    )
+    args = parser.parse_args()
+    if not 0.0 <= args.error_rate <= 1.0:
+        parser.error("--error-rate must be between 0 and 1")
+    if min(args.latency, args.jitter, args.token_delay, args.cold_start, args.idle_timeout) < 0:
+        parser.error("--latency, --jitter, --token-delay, --cold-start and --idle-timeout must not be negative")
+    return args
+
+
+async def serve(backend: MockBackend, host: str, port: int):
+    """Listen on host:port until cancelled."""
+    server = await asyncio.start_server(backend.handle, host, port, backlog=4096)
+    print(f"Mock PromptGPT listening on http://{host}:{port}/ (API key: {backend.api_key})")
+    sys.stdout.flush()
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    backend = MockBackend(
+        api_key=args.api_key,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        max_body=args.max_body,
+        stream=args.stream,
+        token_delay=args.token_delay,
+        reply=args.reply,
+        cold_start=args.cold_start,
+        idle_timeout=args.idle_timeout,
+    )
+    try:
+        asyncio.run(serve(backend, args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"\nServed {backend.requests} requests")
+
+
+if __name__ == "__main__":
+    main()